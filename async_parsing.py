@@ -0,0 +1,176 @@
+'''Parsing input as it arrives in an asyncio program.
+
+`parser_objects.Parser` takes its input a chunk at a time (`feed`/`close`),
+so there is no need to wait for all of it.  Here the chunks come from an
+`asyncio.StreamReader` or an async iterator of bytes or str, and the parser
+lets other tasks run each time it has used up a `budget` of work.  Work is
+counted as the characters scanned plus the actions the parser takes, since
+one token can set off any number of reductions (a long right associative
+chain only reduces at its end, and a whole document at the end of the input).
+The scanner only looks at each character once even when a token is split
+between pieces, so however big a document (or a token in it) is, it holds up
+the event loop for a bounded time per step:
+
+    parser = tables.parser(sequence=True)
+    async for tree in parse_stream(parser, reader):
+        ...
+'''
+import asyncio
+import codecs
+import logging
+logger = logging.getLogger(__name__)
+
+# Characters scanned plus parser actions between letting other tasks run.
+DEFAULT_BUDGET = 16384
+
+async def raw_chunks(source, size):
+    if isinstance(source, asyncio.StreamReader):
+        while True:
+            chunk = await source.read(size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        async for chunk in source:
+            yield chunk
+
+async def text_pieces(source, budget, encoding='utf-8'):
+    '''The text from `source` in pieces of at most `budget` characters.  Bytes
+    are decoded as they come, so characters may be split between chunks.'''
+    decoder = codecs.getincrementaldecoder(encoding)()
+    async for chunk in raw_chunks(source, budget):
+        if not isinstance(chunk, str):
+            chunk = decoder.decode(chunk)
+        for start in range(0, len(chunk), budget):
+            yield chunk[start:start + budget]
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+async def parse_stream(parser, source, budget=DEFAULT_BUDGET,
+                       encoding='utf-8'):
+    '''Each parse completed by feeding `parser` (a `parser_objects.Parser`)
+    everything from `source`, as soon as it is complete.'''
+    assert(budget > 0)
+    pieces = text_pieces(source, budget, encoding)
+    work = 0
+    while True:
+        try:
+            piece = await pieces.__anext__()
+        except StopAsyncIteration:
+            piece = None
+        if piece is None:
+            steps = parser.closing()
+        else:
+            work += len(piece)
+            steps = parser.feeding(piece)
+        for _ in steps:
+            work += 1
+            if work >= budget:
+                for tree in parser.take_completed():
+                    yield tree
+                await asyncio.sleep(0)
+                work = 0
+        for tree in parser.take_completed():
+            yield tree
+        if piece is None:
+            return
+        if work >= budget:
+            await asyncio.sleep(0)
+            work = 0
+
+async def parse(parser, source, budget=DEFAULT_BUDGET, encoding='utf-8'):
+    '''The parse tree of everything from `source`.'''
+    trees = [tree async for tree in parse_stream(parser, source, budget,
+                                                 encoding)]
+    assert(len(trees) == 1)
+    return trees[0]
+
+if __name__ == '__main__':
+    import default_log_arg
+    import general_tokenizer
+    import parser_objects
+    default_log_arg.do_default_logarg()
+    tables = parser_objects.Grammar.from_file('tutorial-grammar.txt').tables()
+    texts = ['n * (4+5)*3 + -somename', '1', '-(a+b)*c']
+    expected = [tables.parser().parse(text) for text in texts]
+    stream = '\n'.join(texts)
+
+    async def from_list(chunks):
+        for chunk in chunks:
+            yield chunk
+
+    async def main():
+        # Chunks of str or bytes, split anywhere, from a reader or iterator.
+        for split in range(len(stream) + 1):
+            for chunks in ([stream[:split], stream[split:]],
+                           [stream[:split].encode(), stream[split:].encode()]):
+                assert([tree async for tree in parse_stream(
+                            tables.parser(sequence=True), from_list(chunks))]
+                       == expected)
+            reader = asyncio.StreamReader()
+            reader.feed_data(texts[0][:split].encode())
+            reader.feed_data(texts[0][split:].encode())
+            reader.feed_eof()
+            assert(await parse(tables.parser(), reader, budget=3)
+                   == expected[0])
+        # Characters split between chunks of bytes.
+        pieces = [piece async for piece in text_pieces(
+                    from_list([b'a\xc2', b'\xa0b']), budget=1)]
+        assert(pieces == ['a', '\xa0', 'b'])
+
+        # A big document doesn't keep other tasks from running.
+        big = '\n'.join(['a * (b + 1)'] * 2000)
+        ticks = 0
+        done = False
+        async def ticker():
+            nonlocal ticks
+            while not done:
+                ticks += 1
+                await asyncio.sleep(0)
+        task = asyncio.create_task(ticker())
+        trees = [tree async for tree in parse_stream(
+                    tables.parser(sequence=True), from_list([big]),
+                    budget=1000)]
+        done = True
+        await task
+        assert(trees == [tables.parser().parse('a * (b + 1)')] * 2000)
+        assert(ticks >= len(big) // 1000)
+
+        # Nor do reductions put off to the end of the input: a right
+        # associative chain only reduces once it has all been read.
+        chain = ' ^ '.join(['a'] * 400)
+        ticks = 0
+        done = False
+        ended = None
+        async def chain_source():
+            nonlocal ended
+            yield chain
+            ended = ticks
+        task = asyncio.create_task(ticker())
+        precedence = parser_objects.Grammar.from_file(
+                        'precedence-grammar.txt').tables()
+        tree = await parse(precedence.parser(), chain_source(), budget=50)
+        done = True
+        await task
+        assert(tree == precedence.parser().parse(chain))
+        assert(ticks - ended >= 400 // 50)
+
+        # Nor does a token split over many steps: each step only scans the
+        # piece it is given, not the start of the token again.
+        scanned = []
+        scan = general_tokenizer.Scanner.scan
+        def counting_scan(self, text, final):
+            scanned.append(len(text))
+            return scan(self, text, final)
+        general_tokenizer.Scanner.scan = counting_scan
+        try:
+            name = 'n' * 100000
+            tree = await parse(tables.parser(), from_list(['a + ' + name]),
+                               budget=100)
+        finally:
+            general_tokenizer.Scanner.scan = scan
+        assert(tree == tables.parser().parse('a + ' + name))
+        assert(len(scanned) > len(name) // 100 and max(scanned) <= 100)
+
+    asyncio.run(main())
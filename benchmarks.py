@@ -0,0 +1,402 @@
+'''Timing comparisons of the different generators on synthetic grammars.
+
+The grammars in this directory are too small to show much difference, so we
+generate expression grammars with a configurable number of precedence levels.
+Each level adds a nonterminal, an operator terminal and two productions.
+'''
+import contextlib
+import functools
+import os
+import pickle
+import string
+import tempfile
+import time
+import tracemalloc
+import generator_take2
+import canonical_lr_generator
+import general_tokenizer
+import manual_tables
+import packed_tables
+import table_cache
+import parsing_from_text
+from parse_grammar import get_rules, get_rules_and_tokens
+import logging
+logger = logging.getLogger(__name__)
+
+def operator_token(i):
+    '''Named token line for the i'th operator.  Only the generators are timed,
+    so it does not matter that operators may share characters.'''
+    char = string.punctuation[i % len(string.punctuation)]
+    return 'op{} := {} {}'.format(i, char, char)
+
+def synthetic_grammar(levels):
+    lines = ['Start = E0']
+    for i in range(levels):
+        lines.append('E{} = E{} op{} E{}'.format(i, i, i, i+1))
+        lines.append('E{} = E{}'.format(i, i+1))
+        lines.append(operator_token(i))
+    lines.append('E{} = ( E0 )'.format(levels))
+    lines.append('E{} = name'.format(levels))
+    lines.append('name := abcdefghijklmnopqrstuvwxyz abcdefghijklmnopqrstuvwxyz')
+    return '\n'.join(lines) + '\n'
+
+def many_terminals_grammar(operators):
+    '''A single expression level with `operators` different binary operators.
+    Every operator ends up in the lookahead sets of most items, so this shows
+    the cost of handling lookahead sets in the canonical LR(1) generator.'''
+    lines = ['Start = E', 'E = T']
+    for i in range(operators):
+        lines.append('E = E op{} T'.format(i))
+        lines.append(operator_token(i))
+    lines.append('T = ( E )')
+    lines.append('T = name')
+    lines.append('name := abcdefghijklmnopqrstuvwxyz abcdefghijklmnopqrstuvwxyz')
+    return '\n'.join(lines) + '\n'
+
+@contextlib.contextmanager
+def grammar_file(text):
+    '''The generators take filenames, so write the grammar somewhere.'''
+    fd, filename = tempfile.mkstemp(suffix='.txt', text=True)
+    try:
+        with os.fdopen(fd, 'w') as outfile:
+            outfile.write(text)
+        yield filename
+    finally:
+        os.remove(filename)
+
+def time_call(func, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+GENERATORS = {
+    'slr': lambda f: generator_take2.generate_action_tables(f),
+    'canonical': lambda f: canonical_lr_generator.generate_action_tables(f),
+    'auto': lambda f: canonical_lr_generator.generate_action_tables(f, 'auto'),
+}
+
+def compare_generators(levels, generators=GENERATORS, repeat=3,
+                       make_grammar=synthetic_grammar):
+    '''Best time (in seconds) of each generator on a grammar with `levels`
+    precedence levels (or whatever `make_grammar` does with its argument).'''
+    with grammar_file(make_grammar(levels)) as filename:
+        return {name: time_call(func, filename, repeat=repeat)
+                for name, func in generators.items()}
+
+def format_results(results, label='levels'):
+    names = list(next(iter(results.values())))
+    lines = ['{:>8}  '.format(label) +
+             '  '.join('{:>22}'.format(x) for x in names)]
+    for levels, timings in results.items():
+        lines.append('{:>8}  '.format(levels) +
+                     '  '.join('{:>21.4f}s'.format(timings[x]) for x in names))
+    return '\n'.join(lines)
+
+####### Lookahead sets
+# Lookahead sets are int bitmasks in the canonical generator.  To see what
+# that saves over frozensets of terminal names, take the lookahead sets of
+# every item of the canonical states of a grammar and do the work the
+# generator does with them -- union them while closing a state, test subsets
+# when merging a kernel into a state already found, and hash the new sets as
+# part of an item -- in both representations on the same sets.
+def lookahead_sets(operators):
+    '''Lookahead sets of the items of each canonical state of
+    `many_terminals_grammar(operators)`, as bitmasks and as frozensets.'''
+    analysis = canonical_lr_generator.analyse_grammar(
+                    many_terminals_grammar(operators))
+    states = canonical_lr_generator.states_for(analysis, 'canonical')
+    bits = [[p.follow_set for p in state]
+            for state in states.num_to_state.values()]
+    sets = [[frozenset(analysis.from_bits(b)) for b in row] for row in bits]
+    return bits, sets
+
+def merge_bits(rows):
+    for row in rows:
+        merged = 0
+        for s in row:
+            merged = merged | s
+        for s in row:
+            assert(s & ~merged == 0)
+            hash(s | merged)
+
+def merge_sets(rows):
+    for row in rows:
+        merged = frozenset()
+        for s in row:
+            merged = merged | s
+        for s in row:
+            assert(s <= merged)
+            hash(s | merged)
+
+def compare_lookahead_sets(operators, repeat=3):
+    '''Best time to union, compare and hash the lookahead sets of the
+    canonical states of `many_terminals_grammar(operators)` as frozensets
+    and as bitmasks.'''
+    bits, sets = lookahead_sets(operators)
+    return {'frozenset': time_call(merge_sets, sets, repeat=repeat),
+            'bitmask': time_call(merge_bits, bits, repeat=repeat)}
+
+####### Unit productions
+def expression_tokens(levels, terms):
+    '''Tokens for an expression of `terms` names in `synthetic_grammar`,
+    cycling through the operators.'''
+    tokens = [('name', 'x0')]
+    for i in range(1, terms):
+        op = i % levels
+        tokens.append(('op{}'.format(op), string.punctuation[op]))
+        tokens.append(('name', 'x{}'.format(i)))
+    return tokens
+
+def driver_allocations(parse, driver):
+    '''Blocks of memory allocated by code in the module `driver` and still
+    in use once `parse()` returns (the nodes of the tree it made), and the
+    peak bytes in use while parsing, as traced by `tracemalloc`.'''
+    tracemalloc.start()
+    try:
+        tree = parse()
+        peak = tracemalloc.get_traced_memory()[1]
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    assert(tree)
+    kept = snapshot.filter_traces(
+            [tracemalloc.Filter(True, driver.__file__)]).statistics('filename')
+    return sum(x.count for x in kept), peak
+
+def compare_unit_elimination(levels, repeat=3, terms=200):
+    '''Reductions, allocations and peak memory per token, and time to
+    parse, with the closure tables of `manual_tables`, and with the packed
+    tables as they are and with unit productions collapsed keeping and
+    eliding their nodes.  Allocations are the blocks each driver allocated
+    that the tree still holds, measured with `tracemalloc` (see
+    `driver_allocations`), and savings are against the closure tables.'''
+    text = synthetic_grammar(levels)
+    with grammar_file(text) as filename:
+        action_tables = canonical_lr_generator.generate_action_tables(
+                            filename, 'lalr')
+    rules = get_rules(text)
+    tokens = expression_tokens(levels, terms)
+    # Include the end marker.
+    num_tokens = len(tokens) + 1
+    full = packed_tables.parse(
+            packed_tables.PackedTables.from_action_tables(action_tables), tokens)
+    reductions = packed_tables.count_nodes(full)
+    units = reductions - packed_tables.count_nodes(
+                packed_tables.elide_unit_nodes(full, rules))
+    def parse_closures():
+        st = manual_tables.State(action_tables)
+        for kind, value in tokens + [('$', '')]:
+            manual_tables.advance(st, kind, value)
+        return st.accepted_expressions.pop()
+    assert(parse_closures() == full)
+    drivers = [('closures', parse_closures, manual_tables, 0)]
+    for label, keep_nodes in [('packed', None), ('keep nodes', True),
+                              ('elide nodes', False)]:
+        tables = packed_tables.PackedTables.from_action_tables(action_tables)
+        if keep_nodes is not None:
+            packed_tables.eliminate_unit_productions(tables, rules, keep_nodes)
+        drivers.append((label, functools.partial(packed_tables.parse, tables,
+                                                 tokens),
+                        packed_tables, units if keep_nodes is not None else 0))
+    results = {}
+    for label, parse, driver, collapsed in drivers:
+        allocations, peak = driver_allocations(parse, driver)
+        results[label] = {
+            'reductions/token': (reductions - collapsed) / num_tokens,
+            'unit reductions/token': (units - collapsed) / num_tokens,
+            'allocations/token': allocations / num_tokens,
+            'allocations saved/token': (
+                results['closures']['allocations/token']
+                - allocations / num_tokens if results else 0),
+            'peak bytes/token': peak / num_tokens,
+            'parse time': time_call(parse, repeat=repeat),
+        }
+    return results
+
+def format_unit_results(levels, results):
+    lines = ['{} levels'.format(levels)]
+    for label, values in results.items():
+        lines.append('{:>14}  '.format(label) + '  '.join(
+            '{}: {:.4g}'.format(k, v) for k, v in values.items()))
+    return '\n'.join(lines)
+
+####### Parallel item sets
+def compare_parallel(levels, worker_counts, repeat=3):
+    '''Best time to build the canonical tables for `synthetic_grammar(levels)`
+    serially and with each number of worker processes (including starting
+    the pool).  Also checks the tables are byte for byte the same.'''
+    def tables(filename, workers):
+        return pickle.dumps(table_cache.describe_tables(
+                canonical_lr_generator.generate_action_tables(
+                    filename, workers=workers)))
+    with grammar_file(synthetic_grammar(levels)) as filename:
+        serial = tables(filename, None)
+        results = {'serial': time_call(tables, filename, None, repeat=repeat)}
+        for workers in worker_counts:
+            assert(tables(filename, workers) == serial)
+            results['{} workers'.format(workers)] = time_call(
+                    tables, filename, workers, repeat=repeat)
+    return results
+
+####### Tokenizer
+def tokenizer_text(kinds, tokens):
+    '''Text using names, ints and the first of `kinds` single character
+    tokens (the rest only make the tokenizer bigger).'''
+    ops = [chr(0x100 + i) for i in range(min(kinds, 8))]
+    words = ['name{}'.format(i) if i % 2 else str(i) for i in range(tokens)]
+    return ' '.join(w + ops[i % len(ops)] for i, w in enumerate(words))
+
+def tokenizer_throughput(kinds, repeat=3, tokens=2000):
+    '''Characters per second through `general_tokenizer.Tokenizer` for a
+    grammar with names, ints and `kinds` single character tokens, and the
+    time taken to make the tokenizer.'''
+    named = {'name': (string.ascii_letters, string.ascii_letters + string.digits),
+             'int': (string.digits, string.digits)}
+    unnamed = [chr(0x100 + i) for i in range(kinds)]
+    text = tokenizer_text(kinds, tokens)
+    def output(*args):
+        pass
+    def make():
+        return general_tokenizer.Tokenizer(
+                general_tokenizer.states_from_grammar(named, unnamed, output),
+                output)
+    def run(tok):
+        for ch in text:
+            tok.consume_char(ch)
+        tok.eof()
+    best = float('inf')
+    for _ in range(repeat):
+        tok = make()
+        start = time.perf_counter()
+        run(tok)
+        best = min(best, time.perf_counter() - start)
+    return len(text) / best, time_call(make, repeat=repeat)
+
+def scanning_throughput(size, repeat=3):
+    '''MB/s through the tutorial grammar's tokenizer, a character at a time
+    (`ParametrisedTokenizer`) and matching whole tokens
+    (`ScanningTokenizer`), on about `size` bytes of text.'''
+    line = 'n * (4+5)*3 + -somename\n\tvalue + 12 * ( other+x ) \n'
+    text = line * max(1, size // len(line))
+    with open('tutorial-grammar.txt') as infile:
+        _, named_tokens, unnamed_tokens = get_rules_and_tokens(infile.read())
+    def run(tokenizer):
+        tokens = []
+        tokenizer.init(lambda *args: tokens.append(args))
+        tokenizer.consume_text(text)
+        tokenizer.eof()
+        return tokens
+    results = {}
+    for kind in (parsing_from_text.ParametrisedTokenizer,
+                 parsing_from_text.ScanningTokenizer):
+        tokenizer = kind(named_tokens, unnamed_tokens)
+        results[kind.__name__] = (len(text.encode()) / 1e6
+                                  / time_call(run, tokenizer, repeat=repeat))
+    assert(run(parsing_from_text.ParametrisedTokenizer(named_tokens,
+                                                       unnamed_tokens))
+           == run(parsing_from_text.ScanningTokenizer(named_tokens,
+                                                      unnamed_tokens)))
+    return results
+
+def span_memory(size, names=100):
+    '''Peak bytes allocated parsing a file of about `size` bytes of `names`
+    long names added together with the tutorial grammar, read into a string and tokenized into
+    strings (`ScanningTokenizer`), and mapped and tokenized into spans of the
+    mapping (`SpanTokenizer`).  The mapping itself is paged in from the file
+    and so isn't counted.'''
+    with open('tutorial-grammar.txt') as infile:
+        _, named_tokens, unnamed_tokens = get_rules_and_tokens(infile.read())
+    action_table = canonical_lr_generator.generate_action_tables(
+                        'tutorial-grammar.txt')
+    text = ' + '.join(['n' * max(1, size // names - 3)] * names)
+    def read_and_parse(filename):
+        with open(filename) as infile:
+            return parsing_from_text.general_parse_from_string(
+                        infile.read(),
+                        parsing_from_text.ScanningTokenizer(named_tokens,
+                                                            unnamed_tokens),
+                        action_table)
+    def map_and_parse(filename):
+        return parsing_from_text.parse_file(
+                    filename,
+                    parsing_from_text.SpanTokenizer(named_tokens,
+                                                    unnamed_tokens),
+                    action_table)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'input.txt')
+        with open(filename, 'w') as outfile:
+            outfile.write(text)
+        for name, parse in [('strings', read_and_parse),
+                            ('spans', map_and_parse)]:
+            tracemalloc.start()
+            tree = parse(filename)
+            results[name] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            if name == 'strings':
+                expected = tree
+            else:
+                assert(parsing_from_text.materialise(tree) == expected)
+            del tree
+    return results
+
+if __name__ == '__main__':
+    import argparse
+    import default_log_arg
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--levels', type=int, nargs='+', default=[2, 4, 8])
+    parser.add_argument('--terminals', type=int, nargs='+', default=[8, 16],
+                        help='Operator counts for the many terminals grammar')
+    parser.add_argument('--unit-levels', type=int, nargs='+', default=[4],
+                        help='Levels to compare unit production elimination')
+    parser.add_argument('--parallel-levels', type=int, nargs='+', default=[8],
+                        help='Levels to compare parallel item set '
+                             'construction')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2],
+                        help='Worker process counts for the parallel build')
+    parser.add_argument('--token-kinds', type=int, nargs='+',
+                        default=[8, 64, 512],
+                        help='Token kinds to compare tokenizer throughput')
+    parser.add_argument('--scan-bytes', type=int, default=100000,
+                        help='Size of the text to compare tokenizers on')
+    parser.add_argument('--span-bytes', type=int, default=1000000,
+                        help='Size of the file to compare parsing into strings '
+                             'and spans on')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = default_log_arg.add_default_logarg(parser)
+    results = {levels: compare_generators(levels, repeat=args.repeat)
+               for levels in args.levels}
+    print(format_results(results))
+    # Only time building the item sets, since that is where lookahead sets
+    # are handled.
+    canonical = {'canonical item sets':
+                    lambda f: canonical_lr_generator.generate_states(f)}
+    results = {count: compare_generators(count, canonical, args.repeat,
+                                         many_terminals_grammar)
+               for count in args.terminals}
+    print(format_results(results, 'ops'))
+    results = {count: compare_lookahead_sets(count, args.repeat)
+               for count in args.terminals}
+    print('Lookahead set operations, frozenset and bitmask')
+    print(format_results(results, 'ops'))
+    for levels in args.unit_levels:
+        print(format_unit_results(levels, compare_unit_elimination(
+                                            levels, args.repeat)))
+    print('Tokenizer throughput')
+    for kinds in args.token_kinds:
+        print('{:>8} kinds  {:>10.0f} chars/s  {:.4f}s to make'.format(
+                kinds, *tokenizer_throughput(kinds, args.repeat)))
+    print('Tokenizing {} bytes:'.format(args.scan_bytes))
+    for name, rate in scanning_throughput(args.scan_bytes,
+                                          args.repeat).items():
+        print('{:>24}  {:8.2f} MB/s'.format(name, rate))
+    print('Peak memory parsing {} bytes:'.format(args.span_bytes))
+    for name, peak in span_memory(args.span_bytes).items():
+        print('{:>24}  {:8.2f} MB'.format(name, peak / 1e6))
+    print('Parallel canonical construction ({} cores)'.format(os.cpu_count()))
+    results = {levels: compare_parallel(levels, args.workers, args.repeat)
+               for levels in args.parallel_levels}
+    print(format_results(results))
@@ -10,23 +10,28 @@
 #   - Also, the FOLLOW set is generated in a completely different way.
 
 
-from parse_grammar import get_rules, get_rules_and_tokens
+from parse_grammar import get_rules, get_rules_and_tokens, get_precedence
 import manual_tables
+import grammar_analysis
 import enum
 from dataclasses import dataclass
 import collections
+import concurrent.futures
+import functools
 import itertools as itt
+import threading
 import parsing_from_text
+import lalr_generator
+import table_cache
+import minimise_tables
+import generator_take2
+import pprint
+import time
 import logging
 logger = logging.getLogger(__name__)
 
 # Rules are a dictionary of nonterminal: [expansion, ...]
 # Each expansion is the current List of expansions is all the possible expansions.
-def transitive_closure_mutable(init, update):
-    while update(init):
-        pass
-    return init
-
 def make_terminal_func(nonterminals):
     def terminal(tok):
         return tok not in nonterminals
@@ -35,30 +40,16 @@ def make_terminal_func(nonterminals):
 def all_nonterminals(rules):
     return set(rules.keys())
 
-####### Finding Nullable symbols.
-
-def known_nullable(sym, expansions, already_known):
-    if sym in already_known:
-        return True
-    def nullable_gen(gen):
-        return all(x in already_known for x in gen)
-    return any(nullable_gen(x) for x in expansions)
+# Nullable symbols, FIRST, and the FOLLOW sets within each itemset are found by
+# building a dependency graph once and solving it over its strongly connected
+# components (see grammar_analysis.py).
 
+####### Finding Nullable symbols.
 def nullable_syms(rules):
-    def update_nullable(verified_nullable):
-        logger.debug('update_nullable: ' + str(verified_nullable))
-        ret = False
-        for key, val in rules.items():
-            if key in verified_nullable:
-                continue
-            if known_nullable(key, val, verified_nullable):
-                verified_nullable.add(key)
-                ret = True
-        return ret
-    return transitive_closure_mutable(set(), update_nullable)
+    return grammar_analysis.nullable_syms(rules)
     
 #######  FIRST set.
-def first(rules, nullable):
+def first(rules, nullable, terminal):
     # At one point I was concerned that FIRST(x) could need FOLLOW to figure out.
     # I.e. when x is nullable.  I think this is not a problem since FIRST is
     # only used in FOLLOW, so if I make sure to check for x being nullable when
@@ -67,30 +58,24 @@ def first(rules, nullable):
     # Instead, FIRST just needs to find everything that *could* start a given
     # nonterminal.  The possibility that a given nonterminal may expand to
     # nothing doesn't need to be represented in this data structure.
-    SymStore = collections.namedtuple('SymStore', ['terminals', 'nonterminals'])
-    first_items = collections.defaultdict(lambda: SymStore(set(), set()))
-    for key, val in rules.items():
-        item = first_items[key]
-        for gen in val:
-            for sym in gen:
-                toupdate = item.terminals if terminal(sym) else item.nonterminals
-                toupdate.add(sym)
-                if sym not in nullable:
-                    break
-    def update_first(current_first):
-        ret = False
-        logger.debug('update_first: ' + str(current_first))
-        for key in rules:
-            this_first = current_first[key]
-            for nont in this_first.nonterminals:
-                that_first = current_first[nont]
-                if not this_first.terminals.issuperset(that_first.terminals):
-                    ret = True
-                    this_first.terminals.update(that_first.terminals)
-        return ret
-    finalised_first = transitive_closure_mutable(first_items, update_first)
-    return {key: val.terminals for key, val in finalised_first.items()}
+    return grammar_analysis.first(rules, nullable, terminal)
     
+####### Lookahead sets
+# The follow set on each Prediction is an int bitmask, with the bit
+# `terminal_bits[name]` set for each terminal in the set.  Union,
+# intersection, subset tests and hashing are then single integer operations
+# rather than walking a frozenset of strings.
+# The numbering belongs to the grammar, so `terminal_names` and
+# `terminal_bits` are kept on its `Analysis`, which converts to and from
+# bitmasks with `to_bits` and `from_bits`.
+def make_terminal_numbering(rules, extra, terminal):
+    names = sorted(set(sym for gens in rules.values() for gen in gens
+                       for sym in gen if terminal(sym)).union(extra))
+    return names, {name: 1 << i for i, name in enumerate(names)}
+
+def is_subset(bits, other):
+    return bits & ~other == 0
+
 ####### Itemsets
 # Structure of an SLR itemset is:
 #   - Sequence of items.
@@ -101,17 +86,19 @@ class Prediction:
     key: str
     gen: tuple[str, ...]
     idx: int
-    follow_set: frozenset[str, ...]
+    follow_set: int
     def next_sym(self):
         return self.gen[self.idx] if self.idx < len(self.gen) else None
     def shifted(self):
         assert(self.idx < len(self.gen))
         return Prediction(self.key, self.gen, self.idx+1, self.follow_set)
     def __str__(self):
-        return '{} -> {} . {}\t\t{}'.format(self.key,
+        # Without the grammar's numbering the follow set can only be shown as
+        # its bitmask; `Analysis.describe` names the terminals.
+        return '{} -> {} . {}\t\t{:#x}'.format(self.key,
                                       ' '.join(self.gen[:self.idx]),
                                       ' '.join(self.gen[self.idx:]),
-                                      str(sorted(self.follow_set)))
+                                      self.follow_set)
 @dataclass(frozen=True)
 class ItemSet:
     predictions: frozenset[Prediction, ...]
@@ -127,18 +114,22 @@ def left_pad(text, padding):
     return '\n'.join(padding+x for x in text.splitlines())
 
 class StateStore:
-    def __init__(self, mapping, reduction_actions, shift_actions, accept_actions):
+    def __init__(self, mapping, reduction_actions, shift_actions, accept_actions,
+                 skipped_closures=0, describe=str):
         self.state_to_num = mapping
         self.num_to_state = {v: k for k, v in mapping.items()}
         self.shift_actions = shift_actions
         self.reduction_actions = reduction_actions
         self.accept_actions = accept_actions
+        self.skipped_closures = skipped_closures
+        self.describe = describe
         assert(set(self.num_to_state.keys()) == set(range(len(mapping))))
     def __str__(self):
         chunks = [list() for _ in self.num_to_state]
         for k, v in sorted(self.num_to_state.items()):
             chunks[k].append('{}:'.format(k))
-            chunks[k].append(left_pad(str(v), '    '))
+            chunks[k].append(left_pad('\n'.join(sorted(
+                                self.describe(x) for x in v)), '    '))
             if self.shift_actions[v]:
                 chunks[k].append('  Shifts:')
                 for sym, next_state in sorted(self.shift_actions[v].items()):
@@ -147,7 +138,9 @@ class StateStore:
             if self.reduction_actions[v]:
                 chunks[k].append('  Reductions:')
                 for sym, pred in sorted(self.reduction_actions[v].items()):
-                    chunks[k].append('    {}:  reduce({})'.format(sym, pred))
+                    chunks[k].append('    {}:  reduce({})'.format(
+                                        sym, self.describe(pred)
+                                             if pred is not None else 'error'))
             if self.accept_actions[v]:
                 chunks[k].append('  Accept on:')
                 for sym in self.accept_actions[v]:
@@ -171,29 +164,37 @@ def extend_predictions(rules, predictions):
         if sym in seen or sym is None:
             continue
         seen.add(sym)
-        extra = [Prediction(sym, tuple(x), 0, frozenset()) for x in rules[sym]]
+        extra = [Prediction(sym, tuple(x), 0, 0) for x in rules[sym]]
         predictions.extend(extra)
         tohandle.extend(x.next_sym() for x in extra)
     return predictions
 
-def update_follows(predictions, first, nullable):
-    SymStore = collections.namedtuple('SymStore', ['terminals', 'follow'])
+def update_follows(predictions, first, nullable, analysis):
+    '''N.b. `first` maps nonterminals to the bitmask of their FIRST set.'''
+    nonterminals = analysis.nonterminals
+    terminal_bits = analysis.terminal_bits
     # The below set of predictions is intereting to know about, but not
     # important to implement the algorithm.
     # already_known = [p for p in predictions if p.idx != 0]
     #
     # We use all predictions for updating the FOLLOW set, then we add that
     # follow set to those predictions that are just starting.
-    follow_items = {p.key: SymStore(set(p.follow_set), set())
-                    for p in predictions if p.idx == 0}
+    follow_terminals = {}
+    follow_chains = {}
+    for p in predictions:
+        if p.idx == 0:
+            # `extend_predictions` may have added a copy of a prediction we
+            # already had with an empty follow set, so don't overwrite.
+            follow_terminals[p.key] = (follow_terminals.get(p.key, 0)
+                                       | p.follow_set)
+            follow_chains[p.key] = set()
     for p in predictions:
         ns = p.next_sym()
-        if terminal(ns):
+        if ns not in nonterminals:
             continue
-        item = follow_items[ns]
+        toadd = 0
         for sym in p.gen[p.idx+1:]:
-            toadd = [sym] if terminal(sym) else first[sym]
-            item.terminals.update(toadd)
+            toadd |= first[sym] if sym in nonterminals else terminal_bits[sym]
             if sym not in nullable:
                 break
         else:
@@ -203,135 +204,713 @@ def update_follows(predictions, first, nullable):
             if p.idx != 0:
                 # Already know the follow set that this has.  Follow set
                 # not affected by calculation of follow set in this group.
-                item.terminals.update(p.follow_set)
+                toadd |= p.follow_set
             else:
-                logger.info('sym: {} in prediction: {}'.format(ns, p))
-                item.follow.add(p.key)
-    def update_follow(current_follow):
-        logger.debug('update_follow: ' + str(current_follow))
-        ret = False
-        for key, this in current_follow.items():
-            for chain in this.follow:
-                that = current_follow[chain]
-                if not this.terminals.issuperset(that.terminals):
-                    ret = True
-                    this.terminals.update(that.terminals)
-        return ret
-    finalised_follow = transitive_closure_mutable(follow_items, update_follow)
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info('sym: {} in prediction: {}'.format(
+                                    ns, analysis.describe(p)))
+                follow_chains[ns].add(p.key)
+        follow_terminals[ns] |= toadd
+    finalised_follow = grammar_analysis.digraph(
+                            list(follow_terminals), follow_chains,
+                            follow_terminals)
     result = []
     for p in predictions:
         if p.idx != 0:
             result.append(p)
             continue
-        result.append(Prediction(p.key, p.gen, p.idx,
-                     frozenset(finalised_follow[p.key].terminals)))
-    logger.debug('update_follows:  {}'.format(pprint.pformat(result)))
+        result.append(Prediction(p.key, p.gen, p.idx, finalised_follow[p.key]))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('update_follows:  {}'.format(pprint.pformat(result)))
     return result
 
 
-def actions_for(predictions, root_term):
+####### Closure templates
+# Closing a kernel rediscovers the same expansions of `rules[sym]` over and
+# over.  The LR(0) part of the closure of a nonterminal does not depend on
+# where it was predicted from, and the lookaheads only depend on it in a
+# limited way.  For each nonterminal B in the closure of A:
+#   - Some lookaheads of B come from inside the closure of A (`spontaneous`).
+#   - B may also get whatever lookaheads A was predicted with (`passes_on`).
+# We find both for every A once up front by closing A with a placeholder bit
+# (one past the last terminal) as its lookahead: bits other than the
+# placeholder are spontaneous, and the placeholder marks B as passing on.
+#
+# Closing a kernel item X -> a . A b with lookaheads L then gives every B in
+# the template of A the lookaheads
+#     spontaneous | (FIRST(b) + (L if b is nullable)  if passes_on)
+# and closing a kernel is the union of that over its items.
+def closure_template(rules, sym, first, nullable, analysis):
+    placeholder = 1 << len(analysis.terminal_names)
+    predictions = [Prediction(sym, tuple(x), 0, placeholder)
+                   for x in rules[sym]]
+    extend_predictions(rules, predictions)
+    follows = {p.key: p.follow_set
+               for p in update_follows(predictions, first, nullable, analysis)
+               if p.idx == 0}
+    return [(key, [tuple(x) for x in rules[key]],
+             bits & ~placeholder, bool(bits & placeholder))
+            for key, bits in follows.items()]
+
+def closure_templates(rules, first, nullable, analysis):
+    # N.b. `extend_predictions` adds empty entries to `rules` for terminals,
+    # which don't need a template.
+    nonterminals = [k for k, v in rules.items() if v]
+    return {sym: closure_template(rules, sym, first, nullable, analysis)
+            for sym in nonterminals}
+
+class LazyTemplates(dict):
+    '''Closure templates made the first time each is needed.'''
+    def __init__(self, rules, first, nullable, analysis):
+        super().__init__()
+        self.rules, self.first, self.nullable = rules, first, nullable
+        self.analysis = analysis
+    def __missing__(self, sym):
+        self[sym] = closure_template(self.rules, sym, self.first,
+                                     self.nullable, self.analysis)
+        return self[sym]
+
+def close_kernel(rules, templates, kernel, first, nullable, suffixes,
+                 analysis):
+    '''Closure of a kernel using the templates from `closure_templates`.
+    `suffixes` caches FIRST(b) and whether b is nullable for X -> a . A b.'''
+    # Predictions at the start of a rule (i.e. in the start state) would need
+    # merging with those from the templates, so just do it the slow way.
+    if any(p.idx == 0 for p in kernel):
+        predictions = extend_predictions(rules, list(kernel))
+        return update_follows(predictions, first, nullable, analysis)
+    nonterminals = analysis.nonterminals
+    terminal_bits = analysis.terminal_bits
+    follows = collections.defaultdict(int)
+    productions = {}
+    for p in kernel:
+        sym = p.next_sym()
+        if sym not in nonterminals:
+            continue
+        rest = (p.gen, p.idx)
+        if rest not in suffixes:
+            bits = 0
+            for following in p.gen[p.idx+1:]:
+                bits |= (first[following] if following in nonterminals
+                         else terminal_bits[following])
+                if following not in nullable:
+                    suffixes[rest] = (bits, False)
+                    break
+            else:
+                suffixes[rest] = (bits, True)
+        bits, passes_on = suffixes[rest]
+        predicted = bits | p.follow_set if passes_on else bits
+        for key, gens, spontaneous, inherits in templates[sym]:
+            follows[key] |= spontaneous | predicted if inherits else spontaneous
+            productions[key] = gens
+    predictions = list(kernel)
+    for key, follow_set in follows.items():
+        predictions.extend(Prediction(key, gen, 0, follow_set)
+                           for gen in productions[key])
+    return predictions
+
+def actions_for(predictions, root_term, analysis):
     ret = collections.defaultdict(list)
     reductions = {}
     accepts = set()
     for p in predictions:
         sym = p.next_sym()
         if sym is None:
-            for f in p.follow_set:
-                # Early assertion error on shift/reduce conflict.
-                assert(f not in ret)
-                # Assertion error on reduce/reduce conflict.
-                assert(f not in reductions)
+            for f in analysis.from_bits(p.follow_set):
+                grammar_analysis.reduce_reduce(reductions, f, p,
+                                               analysis.describe)
                 if p.key == root_term:
                     accepts.add(f)
                 else:
                     reductions[f] = p
             continue
         ret[sym].append(p.shifted())
+    # Shift/reduce conflicts that precedence declarations don't resolve are
+    # left for the caller's `check_conflicts`.
+    grammar_analysis.resolve_conflicts(ret, reductions, analysis.precedence)
     return reductions, ret, accepts
 
+def kernel_closer(rules, analysis, lazy=False):
+    '''Function from a kernel to its closed ItemSet.  With `lazy`, closure
+    templates are made as they are needed rather than all up front.'''
+    nullable = analysis.nullable
+    first_bits = {k: analysis.to_bits(v) for k, v in analysis.first.items()}
+    templates = (LazyTemplates(rules, first_bits, nullable, analysis) if lazy
+                 else closure_templates(rules, first_bits, nullable, analysis))
+    suffixes = {}
+    def closure(kernel):
+        return ItemSet.from_iterable(close_kernel(
+                rules, templates, kernel, first_bits, nullable, suffixes,
+                analysis))
+    return closure
+
+def start_kernel(rules, root_term, root_follow, analysis):
+    return ItemSet.from_iterable(Prediction(root_term, tuple(x), 0,
+                                            analysis.to_bits(root_follow))
+                                 for x in rules[root_term])
+
 # N.b. I'm curious whether there is any way to determine where the start is
 # automatically.
-# Thoughts:
-#   - Hash on kernels rather than entire states?
-#     Should do essentially the same thing, but could save in "seen"
-#     before expanding (saving a bit of work).
-def itemlists(rules, root_term, root_follow, first, nullable):
+# States are recorded against their kernel (the shifted predictions) rather
+# than the entire itemset.  A state is determined by its kernel, so this gives
+# the same states while only expanding each distinct kernel once.
+# `skipped_closures` on the returned StateStore counts how many expansions
+# this avoided.
+# Each state is expanded once, so no GOTO(state, symbol) is ever worked out
+# twice and there is nothing for a memo of them to save: the repeated work is
+# closing the same kernel reached along another path, which this avoids.
+# States are handled in the order they are numbered, and their successors
+# numbered by symbol, so that `parallel_itemlists` can give the same numbers.
+def itemlists(rules, root_term, root_follow, analysis):
     # Approach:
     #  1) Expand all implicit states from the beginning of root_term.
     #     - This gives the first itemlist.
     #  2) For each symbol in any "next" position:
     #     - Create the kernel of a new itemset.
     #     - Expand all implicit states.
-    def add_follows(predictions):
-        return update_follows(predictions, first, nullable)
-    predictions = [Prediction(root_term, tuple(x), 0,
-                              frozenset(root_follow))
-                    for x in rules[root_term]]
-    extend_predictions(rules, predictions)
-    predictions = add_follows(predictions)
-    start = ItemSet.from_iterable(predictions)
-    counter = 0
-    seen = {}
-    tohandle = [start]
+    closure = kernel_closer(rules, analysis)
+    start = start_kernel(rules, root_term, root_follow, analysis)
+    kernels = {start: 0}
+    states = [closure(start)]
+    skipped_closures = 0
     shift_actions = {}
     reduction_actions = {}
     accept_actions = {}
-    while tohandle:
-        s = tohandle.pop()
-        if s in seen:
-            continue
-        seen[s] = counter
-        counter += 1
-        reductions, shifts, accepts = actions_for(s.predictions, root_term)
+    def successor(shifted):
+        nonlocal skipped_closures
+        kernel = ItemSet.from_iterable(shifted)
+        if kernel in kernels:
+            skipped_closures += 1
+        else:
+            kernels[kernel] = len(states)
+            states.append(closure(kernel))
+        return kernels[kernel]
+    num = 0
+    while num < len(states):
+        s = states[num]
+        reductions, shifts, accepts = actions_for(s.predictions, root_term,
+                                                  analysis)
         for sym in sorted(shifts):
-            extend_predictions(rules, shifts[sym])
-            toadd = ItemSet.from_iterable(add_follows(shifts[sym]))
-            shifts[sym] = toadd
-            if toadd not in seen:
-                tohandle.append(toadd)
-        # Assertion error on reduce/shift conflict.
-        assert(not any(x in reductions for x in shifts))
-        assert(not any(x in reductions for x in accepts))
-        assert(not any(y in shifts for y in accepts))
+            shifts[sym] = states[successor(shifts[sym])]
+        grammar_analysis.check_conflicts(shifts, reductions, accepts,
+                                         analysis.describe)
         reduction_actions[s], shift_actions[s], accept_actions[s] = (
                 reductions, shifts, accepts)
-    return StateStore(seen, reduction_actions, shift_actions, accept_actions)
+        num += 1
+    logger.info('Skipped closures: {}'.format(skipped_closures))
+    seen = {s: num for num, s in enumerate(states)}
+    return StateStore(seen, reduction_actions, shift_actions, accept_actions,
+                      skipped_closures, analysis.describe)
+
+####### Parallel construction
+# Nearly all the time in `itemlists` goes on closing kernels and finding the
+# actions of the closed states, and each state can be done without knowing
+# about any other.  `parallel_itemlists` has a pool of worker processes do
+# that for every state found in the last round (the frontier) at once, while
+# this process dedupes the successor kernels they return and numbers the new
+# ones.  Going through the results in state order and the successors of each
+# by symbol gives the states the same numbers `itemlists` does, so the tables
+# are identical.
+# Items are sent between processes as plain (key, gen, idx, follow_set)
+# tuples, which are much quicker to pickle and load than Predictions, and
+# only kernels and actions are sent so the StateStore records each state by
+# its kernel rather than its closure.
+
+# Set in each worker by `start_worker`.  Each worker process builds states for
+# one grammar, so these can be globals.
+worker_closure = None
+worker_root = None
+worker_analysis = None
+
+def start_worker(text, root_term):
+    global worker_closure, worker_root, worker_analysis
+    worker_analysis = analyse_grammar(text)
+    worker_closure = kernel_closer(worker_analysis.fresh_rules(),
+                                   worker_analysis)
+    worker_root = root_term
+
+def item(p):
+    return (p.key, p.gen, p.idx, p.follow_set)
+
+def expand_kernel(kernel):
+    '''Actions of the state with this kernel (a frozenset of items), with
+    the kernels of its successors in place of the states to shift to.'''
+    state = worker_closure([Prediction(*x) for x in kernel])
+    reductions, shifts, accepts = actions_for(state.predictions, worker_root,
+                                              worker_analysis)
+    return ({sym: item(p) if p is not None else None
+             for sym, p in reductions.items()},
+            {sym: frozenset(item(p) for p in shifted)
+             for sym, shifted in shifts.items()},
+            accepts)
+
+def parallel_itemlists(analysis, root_term, root_follow, workers):
+    start = frozenset(item(p) for p in start_kernel(analysis.rules, root_term,
+                                                    root_follow, analysis))
+    kernels = {start: 0}
+    skipped_closures = 0
+    actions = []
+    def successor(kernel):
+        nonlocal skipped_closures
+        if kernel in kernels:
+            skipped_closures += 1
+        else:
+            kernels[kernel] = len(kernels)
+        return kernels[kernel]
+    with concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=start_worker,
+            initargs=(analysis.text, root_term)) as executor:
+        while len(actions) < len(kernels):
+            frontier = list(kernels)[len(actions):]
+            # Big enough chunks that sending them isn't most of the work, small
+            # enough that every worker gets some.
+            chunksize = max(1, len(frontier) // (4 * workers))
+            results = executor.map(expand_kernel, frontier,
+                                   chunksize=chunksize)
+            for num, (reductions, shifts, accepts) in enumerate(
+                                                    results, len(actions)):
+                for sym in sorted(shifts):
+                    shifts[sym] = successor(shifts[sym])
+                grammar_analysis.check_conflicts(shifts, reductions, accepts,
+                                                 analysis.describe)
+                actions.append((reductions, shifts, accepts))
+            logger.debug('Expanded {} states, {} new'.format(
+                            len(frontier), len(kernels) - len(actions)))
+    logger.info('Skipped closures: {}'.format(skipped_closures))
+    states = [ItemSet.from_iterable(Prediction(*x) for x in kernel)
+              for kernel in kernels]
+    predictions = {}
+    def prediction(x):
+        if x not in predictions:
+            predictions[x] = Prediction(*x)
+        return predictions[x]
+    shift_actions = {}
+    reduction_actions = {}
+    accept_actions = {}
+    for s, (reductions, shifts, accepts) in zip(states, actions):
+        reduction_actions[s] = {sym: prediction(x) if x is not None else None
+                                for sym, x in reductions.items()}
+        shift_actions[s] = {sym: states[target]
+                            for sym, target in shifts.items()}
+        accept_actions[s] = accepts
+    seen = {s: num for num, s in enumerate(states)}
+    return StateStore(seen, reduction_actions, shift_actions, accept_actions,
+                      skipped_closures, analysis.describe)
+
+######### Minimal LR(1) by merging compatible states (Pager's PGM).
+# Canonical LR(1) makes a new state for every distinct set of lookaheads on a
+# kernel.  LALR merges every state with the same core (kernel without
+# lookaheads), which can introduce reduce/reduce conflicts.
+# Pager's "practical general method" merges two states with the same core only
+# when they are *weakly compatible*.  For kernel items i and j with lookaheads
+# L1i, L1j in one state and L2i, L2j in the other, the states are weakly
+# compatible if for every pair i != j either:
+#   - (L1i & L2j) | (L1j & L2i) is empty, or
+#   - L1i & L1j is nonempty, or
+#   - L2i & L2j is nonempty.
+# This guarantees the merge introduces no new conflict, so the language
+# accepted is exactly the LR(1) language, while for most grammars the number
+# of states matches LALR.
+#
+# When a merge adds lookaheads to a state that has already been expanded we
+# expand it again.  Its successors then get the extra lookaheads (and may be
+# merged elsewhere), leaving some states unreachable.  Those are dropped at the
+# end.
+def kernel_lookaheads(kernel):
+    '''Map each core item (key, gen, idx) in `kernel` to its lookahead set.'''
+    ret = collections.defaultdict(int)
+    for p in kernel:
+        ret[(p.key, p.gen, p.idx)] |= p.follow_set
+    return dict(ret)
+
+def weakly_compatible(left, right):
+    '''Pager's weak compatibility test for two kernels with the same core.'''
+    assert(left.keys() == right.keys())
+    for i, j in itt.combinations(left, 2):
+        if not ((left[i] & right[j]) or (left[j] & right[i])):
+            continue
+        if not ((left[i] & left[j]) or (right[i] & right[j])):
+            return False
+    return True
+
+def pager_itemlists(rules, root_term, root_follow, analysis):
+    nullable = analysis.nullable
+    first_bits = {k: analysis.to_bits(v) for k, v in analysis.first.items()}
+    templates = closure_templates(rules, first_bits, nullable, analysis)
+    suffixes = {}
+    kernels = []
+    by_core = collections.defaultdict(list)
+    tohandle = []
+    def find_or_add(kernel):
+        lookaheads = kernel_lookaheads(kernel)
+        core = frozenset(lookaheads)
+        for num in by_core[core]:
+            existing = kernels[num]
+            if not weakly_compatible(existing, lookaheads):
+                continue
+            if any(not is_subset(lookaheads[c], existing[c]) for c in core):
+                for c in core:
+                    existing[c] |= lookaheads[c]
+                tohandle.append(num)
+            return num
+        kernels.append(lookaheads)
+        by_core[core].append(len(kernels) - 1)
+        tohandle.append(len(kernels) - 1)
+        return len(kernels) - 1
+
+    find_or_add(list(start_kernel(rules, root_term, root_follow, analysis)))
+    full_states = {}
+    transitions = {}
+    actions = {}
+    while tohandle:
+        num = tohandle.pop()
+        predictions = [Prediction(key, gen, idx, follow)
+                       for (key, gen, idx), follow in kernels[num].items()]
+        full_states[num] = ItemSet.from_iterable(close_kernel(
+                rules, templates, predictions, first_bits, nullable, suffixes,
+                analysis))
+        reductions, shifts, accepts = actions_for(full_states[num], root_term,
+                                                  analysis)
+        grammar_analysis.check_conflicts(shifts, reductions, accepts,
+                                         analysis.describe)
+        transitions[num] = {sym: find_or_add(shifts[sym])
+                            for sym in sorted(shifts)}
+        actions[num] = (reductions, accepts)
+
+    # Only keep the states still reachable from the start, numbered in the
+    # order they are found.
+    reachable = [0]
+    renumber = {0: 0}
+    for num in reachable:
+        for target in transitions[num].values():
+            if target not in renumber:
+                renumber[target] = len(reachable)
+                reachable.append(target)
+    logger.info('Pager: {} states created, {} reachable'.format(
+                    len(kernels), len(reachable)))
+    seen = {}
+    shift_actions = {}
+    reduction_actions = {}
+    accept_actions = {}
+    for num in reachable:
+        s = full_states[num]
+        seen[s] = renumber[num]
+        shift_actions[s] = {sym: full_states[target]
+                            for sym, target in transitions[num].items()}
+        reduction_actions[s], accept_actions[s] = actions[num]
+    return StateStore(seen, reduction_actions, shift_actions, accept_actions,
+                      describe=analysis.describe)
 
 ######### Using that action table to parse.
 def convert_to_action_table(state_store, root_term):
     action_tables = [None]*len(state_store.num_to_state)
     for k, v in state_store.num_to_state.items():
-        shifts = {sym: manual_tables.shift(state_store.state_to_num[next_state])
-                  for sym, next_state in state_store.shift_actions[v].items()}
-        reductions = {sym: manual_tables.red(len(p.gen), p.key)
-                        for sym, p in state_store.reduction_actions[v].items()}
-        accepts = {sym: manual_tables.accept() for sym in state_store.accept_actions[v]}
-        assert(not any(x in shifts for x in reductions))
-        assert(not any(x in accepts for x in reductions))
-        assert(not any(y in shifts for y in accepts))
-        actions = shifts
-        actions.update(reductions)
-        actions.update(accepts)
-        action_tables[k] = actions
+        targets = {sym: state_store.state_to_num[next_state]
+                   for sym, next_state in state_store.shift_actions[v].items()}
+        action_tables[k] = action_row(targets,
+                                      state_store.reduction_actions[v],
+                                      state_store.accept_actions[v])
     assert(None not in action_tables)
-    return action_tables
+    return manual_tables.use_default_reductions(action_tables)
 
-def generate_action_tables(grammar_filename):
-    global terminal
-    with open(grammar_filename) as infile:
-        text = infile.read()
+def action_row(targets, reductions, accepts):
+    '''Row of the action table for a state shifting to the state numbers in
+    `targets`, and with the given reductions and accepts.'''
+    shifts = {sym: manual_tables.shift(target)
+              for sym, target in targets.items()}
+    # A reduction of None is an error from `%nonassoc`.
+    reductions = {sym: manual_tables.red(len(p.gen), p.key)
+                       if p is not None else manual_tables.error()
+                  for sym, p in reductions.items()}
+    accepts = {sym: manual_tables.accept() for sym in accepts}
+    grammar_analysis.check_conflicts(shifts, reductions, accepts)
+    actions = shifts
+    actions.update(reductions)
+    actions.update(accepts)
+    # In symbol order so the tables don't depend on how strings hash.
+    return dict(sorted(actions.items()))
+
+ALGORITHMS = ('canonical', 'lalr', 'pager')
+
+####### Grammar analysis
+# What the constructions need to know about a grammar besides its rules.
+# Found once per grammar so that trying one algorithm after another (see
+# `escalating_action_tables`) doesn't repeat it.
+# The constructions are given the analysis rather than finding the grammar in
+# module globals, so any number of grammars can be generated at once (though
+# being pure Python, threads take turns at it) and lazy tables of different
+# grammars build their rows independently.
+@dataclass
+class Analysis:
+    text: str
+    rules: dict
+    precedence: dict
+    nullable: set
+    nonterminals: set
+    first: dict
+    follow: dict
+    terminal_names: list
+    terminal_bits: dict
+
+    def fresh_rules(self):
+        '''Copy of the rules for one construction, since `extend_predictions`
+        adds empty entries for terminals which would then look like
+        nonterminals to the next one.'''
+        return collections.defaultdict(list, self.rules)
+
+    def to_bits(self, terminals):
+        ret = 0
+        for t in terminals:
+            ret |= self.terminal_bits[t]
+        return ret
+
+    def from_bits(self, bits):
+        '''List of terminal names in the bitmask `bits`.
+        Bits past the last terminal are the placeholder used by
+        `closure_templates`, and are shown as '...'.'''
+        names = self.terminal_names
+        ret = []
+        while bits:
+            lowest = bits & -bits
+            index = lowest.bit_length() - 1
+            ret.append(names[index] if index < len(names) else '...')
+            bits ^= lowest
+        return ret
+
+    def describe(self, p):
+        '''`p` as a string, with its follow set by name.'''
+        return '{} -> {} . {}\t\t{}'.format(p.key,
+                                      ' '.join(p.gen[:p.idx]),
+                                      ' '.join(p.gen[p.idx:]),
+                                      str(sorted(self.from_bits(p.follow_set))))
+
+def analyse_grammar(text):
     all_rules = get_rules(text)
+    precedence = get_precedence(text)
     logger.info('Initial rules: ' + str(all_rules))
     nullable = nullable_syms(all_rules)
     logger.info('Nullable: ' + str(nullable))
     nonterminals = all_nonterminals(all_rules)
     logger.info('Nonterminals: ' + str(nonterminals))
     terminal = make_terminal_func(nonterminals)
-    FIRST = first(all_rules, nullable)
+    terminal_names, terminal_bits = make_terminal_numbering(all_rules, ['$'],
+                                                            terminal)
+    FIRST = first(all_rules, nullable, terminal)
     logger.info('FIRST: ' + str(FIRST))
-    states = itemlists(all_rules, 'Start', ['$'], FIRST, nullable)
-    logger.info('States: ' + str(states))
-    return convert_to_action_table(states, 'Start')
+    FOLLOW = grammar_analysis.follow(all_rules, FIRST, nullable,
+                                     {'Start': ['$']}, terminal)
+    logger.info('FOLLOW: ' + str(FOLLOW))
+    return Analysis(text, all_rules, precedence, nullable, nonterminals,
+                    FIRST, FOLLOW, terminal_names, terminal_bits)
+
+def states_for(analysis, algorithm, workers=None):
+    '''States of `algorithm` (one of ALGORITHMS, or 'slr') for the grammar of
+    `analysis`.  Canonical states are built in `workers` processes if given.'''
+    if workers and algorithm == 'canonical':
+        return parallel_itemlists(analysis, 'Start', ['$'], workers)
+    rules = analysis.fresh_rules()
+    if algorithm == 'slr':
+        return generator_take2.generate_states(
+                rules, analysis.nonterminals, analysis.follow,
+                analysis.precedence)
+    assert(algorithm in ALGORITHMS)
+    if algorithm == 'lalr':
+        states = lalr_generator.itemlists(rules, 'Start', ['$'],
+                                          analysis.nullable,
+                                          analysis.precedence)
+    else:
+        construct = pager_itemlists if algorithm == 'pager' else itemlists
+        states = construct(rules, 'Start', ['$'], analysis)
+    # Formatting every state costs more than generating them on grammars
+    # with many terminals, so avoid it unless the message will be shown.
+    if logger.isEnabledFor(logging.INFO):
+        logger.info('States: ' + str(states))
+    return states
+
+def generate_states(grammar_filename, algorithm='canonical', workers=None):
+    assert(algorithm in ALGORITHMS)
+    with open(grammar_filename) as infile:
+        text = infile.read()
+    return states_for(analyse_grammar(text), algorithm, workers)
+
+####### Lazy tables
+# Most inputs only reach a small part of the automaton of a large grammar, so
+# rather than build every state before the first parse we can build each row
+# of the action table the first time the parser looks at it.  States are
+# numbered as they are found (as successors of a state whose row is built), so
+# the numbers depend on the inputs parsed.  `materialise` builds the rest and
+# numbers them as `itemlists` does, e.g. to store or export the tables.
+class LazyActionTable(dict):
+    '''Canonical LR(1) action table, as from `convert_to_action_table`, whose
+    rows are built when first looked up.  Can be used wherever the parser
+    drivers expect the list of rows.
+
+    A conflict is only found when its state's row is built, so a grammar
+    which isn't LR(1) raises GrammarConflict part way through the first parse
+    to reach that state, and not at all if none does.  Call `check` (or
+    `materialise`) to validate the grammar before relying on the table.
+
+    Parsers in several threads can share the table.  Rows are built under a
+    lock of the table's own, so building them waits for nothing but other
+    rows of the same table.'''
+    def __init__(self, analysis, root_term='Start', root_follow=('$',)):
+        super().__init__()
+        self.analysis = analysis
+        self.root_term = root_term
+        self.lock = threading.Lock()
+        self.closure = kernel_closer(analysis.fresh_rules(), analysis,
+                                     lazy=True)
+        start = start_kernel(analysis.rules, root_term, root_follow, analysis)
+        self.kernels = {start: 0}
+        self.states = [start]
+
+    def __missing__(self, num):
+        with self.lock:
+            # Another thread may have built it while we waited.
+            if num not in self:
+                self[num] = self.build_row(num)
+        return dict.__getitem__(self, num)
+
+    def build_row(self, num):
+        s = self.closure(self.states[num])
+        reductions, shifts, accepts = actions_for(s.predictions, self.root_term,
+                                                  self.analysis)
+        targets = {}
+        for sym in sorted(shifts):
+            successor = ItemSet.from_iterable(shifts[sym])
+            if successor not in self.kernels:
+                self.kernels[successor] = len(self.states)
+                self.states.append(successor)
+            targets[sym] = self.kernels[successor]
+        return manual_tables.use_default_reductions(
+                [action_row(targets, reductions, accepts)])[0]
+
+    def check(self):
+        '''Build every row now, raising GrammarConflict if the grammar has
+        conflicts.  Returns the table.'''
+        built = 0
+        while built < len(self.states):
+            self[built]
+            built += 1
+        return self
+
+    def materialise(self):
+        '''The full action table as a list of rows, numbered as
+        `generate_action_tables` numbers them.'''
+        built = len(self.check().states)
+        # Renumber in the order `itemlists` finds the states: breadth first,
+        # successors by symbol (the order of the rows).
+        descriptions = table_cache.describe_tables(
+                            [self[num] for num in range(built)])
+        order = [0]
+        new_num = {0: 0}
+        for num in order:
+            for desc in descriptions[num].values():
+                if desc[0] == 'shift' and desc[1] not in new_num:
+                    new_num[desc[1]] = len(order)
+                    order.append(desc[1])
+        return table_cache.build_tables(
+                [{sym: ('shift', new_num[desc[1]]) if desc[0] == 'shift'
+                       else desc
+                  for sym, desc in descriptions[num].items()}
+                 for num in order])
+
+def lazy_action_table(grammar_filename):
+    with open(grammar_filename) as infile:
+        text = infile.read()
+    return LazyActionTable(analyse_grammar(text))
+
+####### Escalation
+# SLR tables are the cheapest to build but have conflicts on many grammars
+# (e.g. slr_lr_grammar.txt), LALR has the same number of states and fewer
+# conflicts, and canonical LR(1) handles any LR(1) grammar but can have many
+# more states and takes much longer.  Try each in turn and stop at the first
+# without conflicts.
+ESCALATION = ('slr', 'lalr', 'canonical')
+
+def escalating_action_tables(grammar_filename, algorithms=ESCALATION,
+                             workers=None):
+    '''Action tables from the first of `algorithms` without conflicts on this
+    grammar.  Returns the tables, the algorithm used, and a list of
+    (step, seconds, succeeded) for the analysis and each attempt.
+    If the last algorithm fails too, its GrammarConflict is raised.
+    Canonical states are built in `workers` processes if given.'''
+    with open(grammar_filename) as infile:
+        text = infile.read()
+    start = time.perf_counter()
+    analysis = analyse_grammar(text)
+    attempts = [('analysis', time.perf_counter() - start, True)]
+    return escalate(analysis, algorithms, grammar_filename, attempts, workers)
+
+def escalate(analysis, algorithms=ESCALATION, name='grammar', attempts=None,
+             workers=None):
+    '''As `escalating_action_tables`, for the grammar just analysed.'''
+    attempts = attempts if attempts is not None else []
+    for algorithm in algorithms:
+        start = time.perf_counter()
+        try:
+            states = states_for(analysis, algorithm, workers)
+            action_tables = convert_to_action_table(states, 'Start')
+        except grammar_analysis.GrammarConflict:
+            attempts.append((algorithm, time.perf_counter() - start, False))
+            logger.info('{} has conflicts on {}'.format(algorithm, name))
+            if algorithm == algorithms[-1]:
+                raise
+            continue
+        attempts.append((algorithm, time.perf_counter() - start, True))
+        logger.info(format_attempts(attempts))
+        return action_tables, algorithm, attempts
+
+def format_attempts(attempts):
+    return '\n'.join('    {:10} {:8.4f}s  {}'.format(
+                        step, seconds, 'ok' if succeeded else 'conflict')
+                      for step, seconds, succeeded in attempts)
+
+def escalation_report(grammar_filename):
+    _, algorithm, attempts = escalating_action_tables(grammar_filename)
+    return '{} is {}:\n{}'.format(grammar_filename, algorithm,
+                                  format_attempts(attempts))
+
+def generate_action_tables(grammar_filename, algorithm='canonical',
+                           minimise=False, workers=None):
+    '''Algorithm 'auto' is the first of ESCALATION that works.'''
+    if algorithm == 'auto':
+        action_tables, _, _ = escalating_action_tables(
+                grammar_filename, workers=workers)
+    else:
+        states = generate_states(grammar_filename, algorithm, workers)
+        action_tables = convert_to_action_table(states, 'Start')
+    if minimise:
+        action_tables = minimise_tables.minimise_action_tables(action_tables)
+    return action_tables
+
+def compare_state_counts(grammar_filename):
+    '''Number of states each algorithm gives for this grammar.
+    An algorithm which can not handle the grammar gives None.'''
+    ret = {}
+    for algorithm in ALGORITHMS:
+        try:
+            ret[algorithm] = len(
+                generate_states(grammar_filename, algorithm).num_to_state)
+        except grammar_analysis.GrammarConflict:
+            ret[algorithm] = None
+    return ret
+
+def state_count_report(grammar_filename):
+    counts = compare_state_counts(grammar_filename)
+    lines = ['State counts for {}:'.format(grammar_filename)]
+    for algorithm, count in counts.items():
+        if count is None:
+            lines.append('    {:10} conflict'.format(algorithm))
+            continue
+        merged = len(generate_action_tables(grammar_filename, algorithm, True))
+        line = '    {:10} {:6}    ({:6} after merging equivalent states)'.format(
+                    algorithm, count, merged)
+        if algorithm != 'canonical' and counts['canonical']:
+            line += '    ({:.0%} of canonical)'.format(
+                        count / counts['canonical'])
+        lines.append(line)
+    return '\n'.join(lines)
 
 def get_tokenizer(grammar_filename):
     with open(grammar_filename) as infile:
@@ -339,25 +918,61 @@ def get_tokenizer(grammar_filename):
     _, named_tokens, unnamed_tokens = get_rules_and_tokens(text)
     return parsing_from_text.ParametrisedTokenizer(named_tokens, unnamed_tokens)
 
-def initialise_actions(grammar_filename):
-    action_table = generate_action_tables(grammar_filename)
+def initialise_actions(grammar_filename, algorithm='canonical', use_cache=False,
+                       minimise=False, workers=None):
+    # The number of workers doesn't change the tables, so isn't in the key.
+    generate = functools.partial(generate_action_tables, workers=workers)
+    if use_cache:
+        action_table = table_cache.cached_action_tables(
+                grammar_filename, __file__, generate, algorithm, minimise)
+    else:
+        action_table = generate(grammar_filename, algorithm, minimise)
     logger.info('action_tables: ' + pprint.pformat(action_table))
     manual_tables.initialise_actions(action_table)
 
 if __name__ == '__main__':
+    import pickle
     import pprint
+    import subprocess
     import sys
     import default_log_arg
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('--grammar', default='slr_lr_grammar.txt')
+    parser.add_argument('--algorithm', default='canonical',
+                        choices=ALGORITHMS + ('auto',))
+    parser.add_argument('--report', action='store_true',
+                        help='Print the number of states from each algorithm')
+    parser.add_argument('--escalation-report', action='store_true',
+                        help='Print which algorithm the grammar needs and how '
+                             'long each attempt took')
+    parser.add_argument('--use-cache', action='store_true',
+                        help='Load tables from (and store them in) the '
+                             'on-disk table cache')
+    parser.add_argument('--minimise', action='store_true',
+                        help='Merge equivalent states of the tables')
+    parser.add_argument('--workers', type=int,
+                        help='Build canonical states in this many processes')
+    parser.add_argument('--lazy', action='store_true',
+                        help='Build canonical states as the parser reaches '
+                             'them')
     args = default_log_arg.add_default_logarg(parser)
+    if args.report:
+        print(state_count_report(args.grammar))
+        sys.exit(0)
+    if args.escalation_report:
+        print(escalation_report(args.grammar))
+        sys.exit(0)
     text = sys.stdin.read()
     if text:
-        initialise_actions(args.grammar)
+        if args.lazy:
+            manual_tables.initialise_actions(lazy_action_table(args.grammar))
+        else:
+            initialise_actions(args.grammar, args.algorithm, args.use_cache,
+                               args.minimise, args.workers)
         tokenizer = get_tokenizer(args.grammar)
         parsed_expression = parsing_from_text.general_parse_from_string(
-                                sys.stdin.read(), tokenizer)
+                                text, tokenizer)
         pprint.pprint(parsed_expression)
     else:
         initialise_actions('slr_lr_grammar.txt')
@@ -366,6 +981,10 @@ if __name__ == '__main__':
                                 'b m ef', tokenizer)
         assert(parsed_expression == ['b', [':B', [':L', 'm'], 'e'], 'f'])
         initialise_actions('tutorial-grammar.txt')
+        # States which only reduce do so without waiting for the next token.
+        st = manual_tables.State()
+        manual_tables.advance(st, 'name', 'x')
+        assert(st.forest == [[':Factor', [':Term', [':Minus'], 'x']]])
         tokenizer = get_tokenizer('tutorial-grammar.txt')
         parsed_expression = parsing_from_text.general_parse_from_string(
                                 'n * (4+5)*3 + somename', tokenizer)
@@ -389,5 +1008,129 @@ if __name__ == '__main__':
                       '+',
                       [':Factor', [':Term', [':Minus'], 'somename']]]])
 
-        
-    
+        tokenizer = get_tokenizer('tutorial-grammar.txt')
+        initialise_actions('tutorial-grammar.txt', 'pager')
+        assert(parsing_from_text.general_parse_from_string(
+                    'n * (4+5)*3 + somename', tokenizer) == parsed_expression)
+
+        # Pager's method should give LALR sized tables where the grammar is
+        # LALR, and not merge the states that make a grammar non-LALR.
+        counts = compare_state_counts('tutorial-grammar.txt')
+        assert(counts['pager'] == counts['lalr'] < counts['canonical'])
+        counts = compare_state_counts('lr_not_lalr_grammar.txt')
+        assert(counts['lalr'] is None)
+        assert(counts['pager'] == counts['canonical'])
+        initialise_actions('lr_not_lalr_grammar.txt', 'pager')
+        tokenizer = get_tokenizer('lr_not_lalr_grammar.txt')
+        parsed_expression = parsing_from_text.general_parse_from_string(
+                                'b e d', tokenizer)
+        assert(parsed_expression == ['b', [':E', 'e'], 'd'])
+
+        # Precedence declarations resolve the conflicts of a flat grammar.
+        tokenizer = get_tokenizer('precedence-grammar.txt')
+        for algorithm in ALGORITHMS:
+            initialise_actions('precedence-grammar.txt', algorithm)
+            def name(x):
+                return [':Expr', [':Minus'], x]
+            assert(parsing_from_text.general_parse_from_string(
+                        'a + b * c + d', tokenizer) ==
+                   [[':Expr',
+                     [':Expr', name('a'), '+',
+                      [':Expr', name('b'), '*', name('c')]],
+                     '+', name('d')]])
+            assert(parsing_from_text.general_parse_from_string(
+                        'a ^ b ^ c', tokenizer) ==
+                   [[':Expr', name('a'), '^',
+                     [':Expr', name('b'), '^', name('c')]]])
+            try:
+                parsing_from_text.general_parse_from_string('a < b < c',
+                                                            tokenizer)
+            except KeyError:
+                pass
+            else:
+                assert(not 'Should have failed on %nonassoc')
+
+        # Escalation stops at the cheapest algorithm without conflicts, and
+        # gives the same tables as asking for that algorithm directly.
+        for grammar, expected in [('tutorial-grammar.txt', 'slr'),
+                                  ('slr_lr_grammar.txt', 'lalr'),
+                                  ('lr_not_lalr_grammar.txt', 'canonical')]:
+            action_tables, algorithm, attempts = escalating_action_tables(
+                                                    grammar)
+            assert(algorithm == expected)
+            steps = ('analysis',) + ESCALATION[:ESCALATION.index(expected) + 1]
+            assert([step for step, _, _ in attempts] == list(steps))
+            assert([succeeded for _, _, succeeded in attempts]
+                   == [True] + [False] * (len(steps) - 2) + [True])
+            direct = (generator_take2.generate_action_tables(grammar)
+                      if expected == 'slr'
+                      else generate_action_tables(grammar, expected))
+            assert(table_cache.describe_tables(action_tables)
+                   == table_cache.describe_tables(direct))
+        # Conflicts are found without asserts, so `python -O` escalates too.
+        optimised = subprocess.run(
+                [sys.executable, '-O', '-c',
+                 'import canonical_lr_generator as c; print(c.'
+                 'escalating_action_tables("slr_lr_grammar.txt")[1])'],
+                capture_output=True, text=True, check=True)
+        assert(optimised.stdout.strip() == 'lalr')
+        # 'auto' builds its canonical states in the workers asked for, and
+        # only its canonical states: a pool can't have a negative number of
+        # workers, so asking for one fails when escalation gets to canonical
+        # and not before.
+        generate_action_tables('tutorial-grammar.txt', 'auto', workers=-1)
+        try:
+            generate_action_tables('lr_not_lalr_grammar.txt', 'auto',
+                                   workers=-1)
+        except ValueError:
+            pass
+        else:
+            assert(not 'Should have built canonical states in a pool')
+        auto = generate_action_tables('lr_not_lalr_grammar.txt', 'auto',
+                                      workers=2)
+        assert(pickle.dumps(table_cache.describe_tables(auto))
+               == pickle.dumps(table_cache.describe_tables(
+                    generate_action_tables('lr_not_lalr_grammar.txt'))))
+
+        # Building the canonical states in worker processes gives exactly the
+        # same tables.
+        for grammar in ['tutorial-grammar.txt', 'lr_not_lalr_grammar.txt']:
+            serial = pickle.dumps(table_cache.describe_tables(
+                        generate_action_tables(grammar)))
+            assert(pickle.dumps(table_cache.describe_tables(
+                        generate_action_tables(grammar, workers=2))) == serial)
+
+        # Lazy tables only build the states the parser reaches, and build the
+        # same tables as `generate_action_tables` when asked for all of them.
+        for grammar in ['tutorial-grammar.txt', 'lr_not_lalr_grammar.txt']:
+            action_tables = generate_action_tables(grammar)
+            lazy = lazy_action_table(grammar)
+            tokenizer = get_tokenizer(grammar)
+            manual_tables.initialise_actions(action_tables)
+            text = 'a e c' if grammar == 'lr_not_lalr_grammar.txt' else '1'
+            assert(parsing_from_text.general_parse_from_string(
+                        text, tokenizer, lazy) ==
+                   parsing_from_text.general_parse_from_string(text, tokenizer))
+            assert(len(lazy) < len(action_tables))
+            assert(pickle.dumps(table_cache.describe_tables(lazy.materialise()))
+                   == pickle.dumps(table_cache.describe_tables(action_tables)))
+        # Conflicts only show up in rows that are built, and `check` builds
+        # them all.
+        lazy = LazyActionTable(analyse_grammar('Start = E\nE = E + E\nE = a\n'))
+        lazy[0]
+        try:
+            lazy.check()
+        except grammar_analysis.GrammarConflict:
+            pass
+        else:
+            assert(not 'Should have failed on an ambiguous grammar')
+        # Parsing with lazy tables from the command line.
+        for grammar, text in [('slr_lr_grammar.txt', 'b m ef'),
+                              ('tutorial-grammar.txt', 'n * (4+5)')]:
+            initialise_actions(grammar)
+            expected = parsing_from_text.general_parse_from_string(
+                            text, get_tokenizer(grammar))
+            output = subprocess.run(
+                    [sys.executable, __file__, '--grammar', grammar, '--lazy'],
+                    input=text, capture_output=True, text=True, check=True)
+            assert(output.stdout == pprint.pformat(expected) + '\n')
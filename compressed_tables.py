@@ -0,0 +1,283 @@
+'''Compressed action and goto tables.
+
+Most cells of the action table are errors, and most of the rest of a row are
+often the same reduction.  Starting from the dense `packed_tables.PackedTables`
+we:
+    - Give every row a default action: its most common reduction.  Any cell
+      not stored explicitly takes the default, so an error may only be found
+      after some extra reductions -- but never after shifting another token.
+    - Pack the remaining cells of all rows into one flat array by row
+      displacement (comb packing): row `s` is placed at offset `base[s]` such
+      that its cells don't collide with cells of any other row, and `check`
+      records which row each cell belongs to.
+          pos = base[s] + t
+          action = value[pos] if check[pos] == s else default[s]
+The goto table is packed the same way, by nonterminal (column) rather than by
+state since most nonterminals go to the same state from most places.
+'''
+from array import array
+import collections
+import sys
+import packed_tables
+from packed_tables import ERROR, SHIFT, REDUCE, ACCEPT, OPCODE_BITS, OPCODE_MASK
+import logging
+logger = logging.getLogger(__name__)
+
+def most_common(values):
+    counts = collections.Counter(values)
+    return max(counts, key=lambda x: (counts[x], -x)) if counts else None
+
+def displace(rows, width):
+    '''Pack sparse rows (each a list of (column, value)) into one array.
+    Returns (base, check, value) arrays, with first fit placement of the rows
+    with most entries first.'''
+    base = array('i', [0]) * len(rows)
+    check = array('i')
+    value = array('i')
+    # Every cell before this one is taken, so no row's first cell can go
+    # there, and the search for each row starts from it rather than from 0.
+    first_free = 0
+    for num in sorted(range(len(rows)), key=lambda x: -len(rows[x])):
+        entries = rows[num]
+        if not entries:
+            continue
+        offset = max(0, first_free - min(col for col, _ in entries))
+        while any(offset + col < len(check) and check[offset + col] != -1
+                  for col, _ in entries):
+            offset += 1
+        needed = offset + width - len(check)
+        if needed > 0:
+            check.extend([-1] * needed)
+            value.extend([0] * needed)
+        for col, val in entries:
+            check[offset + col] = num
+            value[offset + col] = val
+        base[num] = offset
+        while first_free < len(check) and check[first_free] != -1:
+            first_free += 1
+    # Lookups check the bounds, so unused cells at the end can go.
+    while check and check[-1] == -1:
+        check.pop()
+        value.pop()
+    return base, check, value
+
+class CompressedTables:
+    def __init__(self, packed):
+        self.terminals = packed.terminals
+        self.nonterminals = packed.nonterminals
+        self.end_marker = packed.end_marker
+        self.terminal_ids = packed.terminal_ids
+        self.production_lengths = packed.production_lengths
+        self.production_names = packed.production_names
+        self.production_lhs = packed.production_lhs
+        # Rows with nothing but a default reduction, reduced as soon as they
+        # are reached as in `packed_tables.advance`.
+        self.default_reduction = packed.default_reduction
+        width = packed.num_terminals
+        num_states = len(packed.action) // width if width else 0
+        self.num_states = num_states
+        defaults = []
+        action_rows = []
+        for state in range(num_states):
+            row = packed.action[state * width:(state + 1) * width]
+            default = most_common(x for x in row
+                                  if x & OPCODE_MASK == REDUCE)
+            default = ERROR if default is None else default
+            defaults.append(default)
+            action_rows.append([(t, x) for t, x in enumerate(row)
+                                if x != default and x != ERROR])
+        self.default_action = array('i', defaults)
+        self.action_base, self.action_check, self.action_value = (
+                displace(action_rows, width))
+        # Goto by column.
+        goto_width = packed.num_nonterminals
+        goto_defaults = []
+        goto_columns = []
+        for nt in range(goto_width):
+            column = packed.goto[nt::goto_width] if goto_width else []
+            default = most_common(x for x in column if x != -1)
+            default = -1 if default is None else default
+            goto_defaults.append(default)
+            goto_columns.append([(s, x) for s, x in enumerate(column)
+                                 if x != default and x != -1])
+        self.default_goto = array('i', goto_defaults)
+        self.goto_base, self.goto_check, self.goto_value = (
+                displace(goto_columns, num_states))
+
+    @classmethod
+    def from_action_tables(cls, action_tables, end_marker='$'):
+        return cls(packed_tables.PackedTables.from_action_tables(action_tables,
+                                                                 end_marker))
+
+    def lookup_action(self, state, term):
+        pos = self.action_base[state] + term
+        if pos < len(self.action_check) and self.action_check[pos] == state:
+            return self.action_value[pos]
+        return self.default_action[state]
+
+    def lookup_goto(self, state, nonterminal):
+        pos = self.goto_base[nonterminal] + state
+        if pos < len(self.goto_check) and self.goto_check[pos] == nonterminal:
+            return self.goto_value[pos]
+        return self.default_goto[nonterminal]
+
+    def buffers(self):
+        return [self.default_reduction, self.default_action, self.action_base,
+                self.action_check, self.action_value, self.default_goto,
+                self.goto_base, self.goto_check, self.goto_value]
+
+def advance(tables, st, next_symbol, value):
+    '''As `packed_tables.advance`, using the compressed tables.'''
+    term = tables.terminal_ids[next_symbol]
+    lookup_action = tables.lookup_action
+    default_reduction = tables.default_reduction
+    lookup_goto = tables.lookup_goto
+    lengths = tables.production_lengths
+    names = tables.production_names
+    lhs = tables.production_lhs
+    stack = st.stack
+    forest = st.forest
+    top = st.top
+    shifted = False
+    while True:
+        packed = default_reduction[top]
+        if packed == ERROR:
+            if shifted:
+                st.top = top
+                return
+            packed = lookup_action(top, term)
+        opcode = packed & OPCODE_MASK
+        if opcode == SHIFT:
+            stack.append(top)
+            forest.append(value)
+            top = packed >> OPCODE_BITS
+            shifted = True
+        elif opcode == REDUCE:
+            prod = packed >> OPCODE_BITS
+            count = lengths[prod]
+            node = [names[prod]]
+            if count:
+                node.extend(forest[-count:])
+                del forest[-count:]
+                top = stack[-count]
+                del stack[-count:]
+            forest.append(node)
+            stack.append(top)
+            top = lookup_goto(top, lhs[prod])
+        elif opcode == ACCEPT:
+            st.top = stack.pop()
+            st.accepted_expressions.append(forest)
+            assert(len(st.accepted_expressions) == 1)
+            return
+        else:
+            st.top = top
+            raise KeyError('Unexpected {!r} ({!r}) in state {}'.format(
+                                next_symbol, value, top))
+
+def parse(tables, tokens):
+    '''Parse an iterable of (token type, text) pairs, without the end marker.'''
+    st = packed_tables.State()
+    for kind, value in tokens:
+        advance(tables, st, kind, value)
+    advance(tables, st, tables.end_marker, '')
+    assert(st.accepted_expressions)
+    return st.accepted_expressions.pop()
+
+####### Reporting
+def dict_table_size(action_tables):
+    '''Bytes used by the list of dicts from `convert_to_action_table`, not
+    counting the closures and symbol names which are shared.'''
+    return sys.getsizeof(action_tables) + sum(sys.getsizeof(row)
+                                              for row in action_tables)
+
+def array_size(buffers):
+    return sum(x.itemsize * len(x) for x in buffers)
+
+def compression_report(action_tables):
+    packed = packed_tables.PackedTables.from_action_tables(action_tables)
+    compressed = CompressedTables(packed)
+    entries = sum(len(row) for row in action_tables)
+    sizes = [('dicts', dict_table_size(action_tables)),
+             ('dense arrays', array_size([packed.action, packed.goto])),
+             ('compressed', array_size(compressed.buffers()))]
+    lines = ['{} states, {} terminals, {} nonterminals, {} table entries'.format(
+                compressed.num_states, len(packed.terminals),
+                len(packed.nonterminals), entries),
+             'compressed: {} action cells, {} goto cells'.format(
+                len(compressed.action_check), len(compressed.goto_check))]
+    for name, size in sizes:
+        lines.append('{:>14}: {:>8} bytes  ({:.2f}x dicts)'.format(
+                        name, size, sizes[0][1] / size if size else 0))
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    import argparse
+    import canonical_lr_generator
+    import default_log_arg
+    import manual_tables
+    import parsing_from_text
+    import parser_module
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--grammar', help='Print a compression report')
+    parser.add_argument('--algorithm', default='canonical',
+                        choices=canonical_lr_generator.ALGORITHMS)
+    args = default_log_arg.add_default_logarg(parser)
+    if args.grammar:
+        print(compression_report(canonical_lr_generator.generate_action_tables(
+                                    args.grammar, args.algorithm)))
+        sys.exit(0)
+    # The rows in the displaced arrays don't collide.
+    base, check, value = displace([[(0, 1), (2, 2)], [(0, 3)], [(1, 4)], []], 3)
+    assert(sorted(x for x in check if x != -1) == [0, 0, 1, 2])
+    assert([value[base[0]], value[base[0] + 2], value[base[1]],
+            value[base[2] + 1]] == [1, 2, 3, 4])
+    # Rows are placed from the first free cell on, so many rows of one
+    # entry each take one cell each.
+    rows = [[(num % 7, num)] for num in range(5000)]
+    base, check, value = displace(rows, 7)
+    assert(len(check) == len(rows))
+    assert(all(value[base[num] + col] == val and check[base[num] + col] == num
+               for num, row in enumerate(rows) for col, val in row))
+
+    for grammar, algorithm, inputs in [
+            ('tutorial-grammar.txt', 'canonical',
+             ['n * (4+5)*3 + -somename', '1', '-(a+b)*c']),
+            ('tutorial-grammar.txt', 'lalr', ['a * b + c']),
+            ('slr_lr_grammar.txt', 'lalr', ['b m ef', 'a n f e'])]:
+        action_tables = canonical_lr_generator.generate_action_tables(
+                            grammar, algorithm)
+        packed = packed_tables.PackedTables.from_action_tables(action_tables)
+        tables = CompressedTables(packed)
+        # Every non-error action and goto is kept.
+        width = packed.num_terminals
+        for pos, x in enumerate(packed.action):
+            if x != ERROR:
+                assert(tables.lookup_action(pos // width, pos % width) == x)
+        width = packed.num_nonterminals
+        for pos, x in enumerate(packed.goto):
+            if x != -1:
+                assert(tables.lookup_goto(pos // width, pos % width) == x)
+        assert(array_size(tables.buffers()) <
+               array_size([packed.action, packed.goto]))
+        manual_tables.initialise_actions(action_tables)
+        tokenizer = canonical_lr_generator.get_tokenizer(grammar)
+        for text in inputs:
+            tokens = parser_module.tokens_from_string(text, tokenizer)
+            assert(parse(tables, tokens) ==
+                   parsing_from_text.general_parse_from_string(text, tokenizer))
+            # Default reductions are made as soon as their state is reached,
+            # as by `packed_tables.advance`, so the two drivers are in the
+            # same state after every token.
+            st, packed_st = packed_tables.State(), packed_tables.State()
+            for kind, token in tokens:
+                advance(tables, st, kind, token)
+                packed_tables.advance(packed, packed_st, kind, token)
+                assert((st.stack, st.forest, st.top) ==
+                       (packed_st.stack, packed_st.forest, packed_st.top))
+    # Errors are still found, if after some default reductions.
+    try:
+        parse(tables, [('a', 'a'), ('a', 'a')])
+    except KeyError:
+        pass
+    else:
+        assert(not 'Should have failed to parse')
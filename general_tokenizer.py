@@ -19,6 +19,7 @@ Tokens in the grammar that I'm handling:
 # implement that approach in the future.
 
 from dataclasses import dataclass, field
+import re
 import string
 import pprint
 import logging
@@ -30,12 +31,15 @@ class TokenizerState:
         self.on_output = on_output
         self.charset_first = charset_first
         self.charset_remainder = charset_remainder
+        # Membership tests against the strings from the grammar scan them.
+        self.first_chars = frozenset(charset_first)
+        self.remainder_chars = frozenset(charset_remainder)
         self.inp = []
     def reset(self, ch):
-        assert(ch in self.charset_first)
+        assert(ch in self.first_chars)
         self.inp = [ch]
     def consume(self, ch):
-        if ch in self.charset_remainder:
+        if ch in self.remainder_chars:
             self.inp.append(ch)
             return True
         return False
@@ -59,6 +63,20 @@ def make_single_char_states(on_output, chars):
 #       sort) and change state according to character.
 
 # `all_states` is a list TokenizerState values.
+# Which state starts with a character is looked up in a map built once from
+# the `charset_first` of every state, rather than asking every state, so the
+# cost per token doesn't grow with the number of kinds of token.
+# (Indexing a list by `ord(ch)` for ASCII characters was measured slower than
+# the dict: single character strings are cached with their hash.)
+# A character starting more than one kind of token maps to None, as does one
+# starting none, and both are an error when seen.
+def dispatch_map(all_states):
+    ret = {}
+    for state in all_states:
+        for ch in state.first_chars:
+            ret[ch] = None if ch in ret else state
+    return ret
+
 class Tokenizer:
     def __init__(self, all_states, on_end):
         logger.debug('Tokenizer init: {}'.format(
@@ -69,6 +87,7 @@ class Tokenizer:
                len(set(x.name for x in all_states)))
         assert(len(all_states) ==
                len(set(x.charset_first for x in all_states)))
+        self.dispatch = dispatch_map(all_states)
         self.current_state = make_nulling_state(set())
         self.column = 1
         self.line   = 1
@@ -76,9 +95,9 @@ class Tokenizer:
         self.inp = []
 
     def choose_state_for(self, ch):
-        ret = [x for x in self.all_states if ch in x.charset_first]
-        assert(len(ret) == 1)
-        return ret[0]
+        ret = self.dispatch.get(ch)
+        assert(ret is not None)
+        return ret
 
     def update_position(self, ch):
         if ch == "\n":
@@ -102,6 +121,243 @@ class Tokenizer:
             self.pos = (self.column, self.line)
         self.update_position(ch)
 
+####### Scanning whole tokens
+# Feeding `Tokenizer` one character at a time costs a few method calls per
+# character.  Every kind of token is a character from its `charset_first`
+# followed by as many characters from its `charset_remainder` as there are,
+# which a regular expression can match in one go:
+#     ([first][remainder]*) | ([first][remainder]*) | ... | ([single chars])
+# The first characters of different kinds of token don't overlap, so at most
+# one alternative can match.  Tokens of a single character are all in the last
+# alternative, and which kind they are is looked up in the dispatch map, so
+# that the expression doesn't grow with the number of operators.  Characters
+# starting more than one kind of token are left out, so they fail to match
+# like characters starting none.
+# `Scanner` gives the same callbacks, with the same positions, as `Tokenizer`
+# -- including the end marker getting the start of the last token (or run of
+# whitespace) as its start position.
+# A token running to the end of a chunk may carry on in the next one, so it is
+# held until we know where it ends.  Only the rest of it is then matched, at
+# the start of the next chunk, and only tokens someone is told about keep
+# their text: runs of whitespace just move the position along.  So however
+# the text is split, each character is matched once and nothing is kept but
+# the text of the one token that isn't finished.
+# On text as dense as the tutorial grammar's (tokens under two characters on
+# average) this is only about 1.0-1.1 times as fast as `Tokenizer`, as most
+# of the time goes on the work per token rather than per character.
+def char_class(chars):
+    return '[{}]'.format(''.join(re.escape(x) for x in sorted(chars)))
+
+def move_over(column, line, text):
+    '''Position after `text` when it starts at (`column`, `line`).'''
+    if '\n' in text:
+        return len(text) - text.rindex('\n'), line + text.count('\n')
+    return column + len(text), line
+
+class Scanner:
+    def __init__(self, all_states, on_end):
+        self.on_end = on_end
+        self.all_states = all_states
+        assert(len(all_states) ==
+               len(set(x.name for x in all_states)))
+        assert(len(all_states) ==
+               len(set(x.charset_first for x in all_states)))
+        self.dispatch = dispatch_map(all_states)
+        ambiguous = set(ch for ch, state in self.dispatch.items()
+                        if state is None)
+        alternatives = []
+        # Index is the group number, None for the single characters.
+        self.group_states = [None]
+        singles = set()
+        # The rest of a token carrying on from the last chunk.
+        self.carry_on_patterns = {}
+        for state in all_states:
+            first = state.first_chars - ambiguous
+            if not first:
+                continue
+            if not state.remainder_chars:
+                singles.update(first)
+                continue
+            alternatives.append('({}{}*)'.format(
+                    char_class(first), char_class(state.remainder_chars)))
+            self.group_states.append(state)
+            self.carry_on_patterns[state] = re.compile(
+                    char_class(state.remainder_chars) + '*')
+        if singles:
+            alternatives.append('({})'.format(char_class(singles)))
+            self.group_states.append(None)
+        self.pattern = re.compile('|'.join(alternatives) or '(?!)')
+        self.reset()
+
+    def reset(self):
+        '''Start again at the beginning of new text.'''
+        self.column = 1
+        self.line   = 1
+        self.pos = (1,1)
+        # State of a token which may carry on in the next chunk, and the text
+        # of it so far (none for whitespace, whose position is kept instead).
+        self.partial = None
+        self.pieces = []
+
+    @property
+    def pending(self):
+        '''Text held until we know where its token ends.'''
+        return ''.join(self.pieces)
+
+    def consume_text(self, text):
+        self.scan(text, False)
+
+    def consume_char(self, ch):
+        self.consume_text(ch)
+
+    def eof(self):
+        self.scan('', True)
+        self.on_end(self.pos, (self.column, self.line))
+
+    def carry_on(self, text, final):
+        '''Match the rest of the partial token at the start of `text`,
+        returning where it ends.'''
+        state = self.partial
+        end = self.carry_on_patterns[state].match(text).end()
+        piece = text[:end]
+        if state.on_output is do_nothing:
+            self.column, self.line = move_over(self.column, self.line, piece)
+        else:
+            self.pieces.append(piece)
+        if end == len(text) and not final:
+            return end
+        self.partial = None
+        if state.on_output is not do_nothing:
+            token = ''.join(self.pieces)
+            self.pieces = []
+            self.pos = (self.column, self.line)
+            self.column, self.line = move_over(self.column, self.line, token)
+            state.on_output(state.name, token, self.pos,
+                            (self.column, self.line))
+        return end
+
+    def scan(self, text, final):
+        '''Report each token in `text`.  Unless `final`, a token running to
+        the end of `text` is kept until we know where it ends.'''
+        pos = 0
+        if self.partial is not None:
+            pos = self.carry_on(text, final)
+            if self.partial is not None:
+                return
+        # Positions are kept in locals and only saved on the way out, and
+        # tokens nobody is told about (whitespace) skip making them into
+        # tuples: per token, that costs more than the matching does.
+        group_states = self.group_states
+        dispatch = self.dispatch
+        column, line = self.column, self.line
+        start_column, start_line = self.pos
+        length = len(text)
+        try:
+            for m in self.pattern.finditer(text, pos):
+                # Assertion error on a character starting no token, or several.
+                assert(m.start() == pos)
+                end = m.end()
+                token = text[pos:end]
+                state = group_states[m.lastindex] or dispatch[token]
+                if end == length and not final and state.remainder_chars:
+                    self.partial = state
+                    if state.on_output is not do_nothing:
+                        # Positions are worked out once the token is whole.
+                        self.pieces.append(token)
+                        pos = end
+                        break
+                start_column, start_line = column, line
+                if '\n' in token:
+                    line += token.count('\n')
+                    column = end - text.rindex('\n', pos, end)
+                else:
+                    column += end - pos
+                pos = end
+                if state.on_output is not do_nothing:
+                    state.on_output(state.name, token, (start_column, start_line),
+                                    (column, line))
+            assert(pos == length)
+        finally:
+            self.pos = (start_column, start_line)
+            self.column, self.line = column, line
+
+####### Tokens as spans of a buffer
+# Copying the text of every token into a string keeps a second copy of the
+# input alive in the parse tree.  `SpanScanner` instead reports each token as
+# a `Span` of the buffer it was scanned from, which can be a `mmap` of the
+# input file, and the text is only made when asked for.  Buffers are bytes,
+# so token characters have to be ASCII, and columns count bytes.
+class Span:
+    __slots__ = ('buffer', 'start', 'end')
+    def __init__(self, buffer, start, end):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+    def text(self):
+        return bytes(self.buffer[self.start:self.end]).decode()
+    def __str__(self):
+        return self.text()
+    def __repr__(self):
+        return 'Span({!r}, {}, {})'.format(self.text(), self.start, self.end)
+
+class SpanScanner(Scanner):
+    def __init__(self, all_states, on_end):
+        super().__init__(all_states, on_end)
+        # Which groups can match a newline, the only ones worth counting them
+        # in (which means copying the token).
+        newline_state = self.dispatch.get('\n')
+        self.group_newlines = [
+            '\n' in state.first_chars | state.remainder_chars if state
+            else newline_state is not None
+            for state in self.group_states]
+        # Assertion error on a token character that isn't ASCII.
+        assert(self.pattern.pattern.isascii())
+        self.pattern = re.compile(self.pattern.pattern.encode())
+        # Indexing a buffer gives the byte as an int.
+        self.dispatch = {ord(ch): state for ch, state in self.dispatch.items()
+                         if ch.isascii()}
+
+    def reset(self):
+        super().reset()
+        self.buffer = None
+
+    def consume_text(self, buffer):
+        '''Scan all of `buffer`, which has to stay unchanged while its
+        spans are in use, so can't come in chunks.'''
+        assert(self.buffer is None)
+        self.buffer = buffer
+        group_states = self.group_states
+        group_newlines = self.group_newlines
+        dispatch = self.dispatch
+        column, line = self.column, self.line
+        start_column, start_line = self.pos
+        pos = 0
+        try:
+            for m in self.pattern.finditer(buffer):
+                # Assertion error on a character starting no token, or several.
+                assert(m.start() == pos)
+                end = m.end()
+                index = m.lastindex
+                state = group_states[index] or dispatch[buffer[pos]]
+                start_column, start_line = column, line
+                if group_newlines[index] and b'\n' in m.group():
+                    token = m.group()
+                    line += token.count(b'\n')
+                    column = len(token) - token.rindex(b'\n')
+                else:
+                    column += end - pos
+                if state.on_output is not do_nothing:
+                    state.on_output(state.name, Span(buffer, pos, end),
+                                    (start_column, start_line), (column, line))
+                pos = end
+            assert(pos == len(buffer))
+        finally:
+            self.pos = (start_column, start_line)
+            self.column, self.line = column, line
+
+    def eof(self):
+        self.on_end(self.pos, (self.column, self.line))
+
 def states_from_grammar(named_tokens, unnamed_tokens, on_output, include_whitespace=True):
     named_states = [TokenizerState(on_output, name, first, remainder)
                     for name, (first, remainder) in named_tokens.items()]
@@ -148,3 +404,98 @@ if __name__ == '__main__':
             (')', ')', (12, 1), (13, 1)),
             ('word', 'x', (14, 1), (15, 1)),
             ('$', '', (14, 1), (15, 1))])
+
+        # Characters starting no token, or more than one, are errors.
+        for bad_text, states in [('a$', all_states),
+                                 ('a', all_states + [TokenizerState(
+                                        action_to_perform, 'other', 'a', '')])]:
+            tok = Tokenizer(states, lambda x, y: None)
+            try:
+                for ch in bad_text:
+                    tok.consume_char(ch)
+            except AssertionError:
+                pass
+            else:
+                assert(not 'Should have failed on {!r}'.format(bad_text))
+
+        # Scanning whole tokens gives the same callbacks, however the text is
+        # split into chunks.
+        def record(make_tokenizer, chunks):
+            tokens = []
+            def output(*args):
+                tokens.append(args)
+            states = states_from_grammar(
+                { 'word': (string.ascii_letters + '_',
+                           string.ascii_letters + '_'),
+                  'digit': (string.digits, string.digits)},
+                '()+*-', output)
+            tok = make_tokenizer(states, lambda x, y: output('$', '', x, y))
+            for chunk in chunks:
+                if isinstance(tok, Scanner):
+                    tok.consume_text(chunk)
+                else:
+                    for ch in chunk:
+                        tok.consume_char(ch)
+            tok.eof()
+            return tokens
+        for text in ['word10* +13) x', '', ' ', 'a\nbc \n\n 12\n', 'x  \n']:
+            expected = record(Tokenizer, [text])
+            assert(record(Scanner, [text]) == expected)
+            for split in range(len(text) + 1):
+                assert(record(Scanner, [text[:split], '', text[split:]])
+                       == expected)
+            assert(record(Scanner, list(text)) == expected)
+        # Only the text of an unfinished token is held between chunks, and
+        # whitespace isn't held at all.
+        tok = Scanner(all_states, lambda x, y: None)
+        for _ in range(3000):
+            tok.consume_text('   ')
+            assert(tok.pending == '')
+        for count in range(1, 3001):
+            tok.consume_text('a')
+            assert(len(tok.pending) == count)
+        tok.consume_text(' ')
+        assert(tok.pending == '')
+        long_name = 'x' * 3000
+        assert(record(Scanner, [' \n  '] * 1000 + list(long_name) + ['+'])
+               == record(Tokenizer, [' \n  ' * 1000 + long_name + '+']))
+        # Including where the text goes wrong.
+        for states in [all_states, all_states + [TokenizerState(
+                                        action_to_perform, 'other', 'a', '')]]:
+            tok = Scanner(states, lambda x, y: None)
+            try:
+                tok.consume_text('a$')
+                tok.eof()
+            except AssertionError:
+                pass
+            else:
+                assert(not 'Should have failed')
+
+        # Spans of a buffer give the same tokens and positions, for any kind
+        # of buffer.
+        def record_spans(buffer):
+            tokens = []
+            def output(name, span, start, end):
+                assert(isinstance(span, Span) and span.buffer is buffer)
+                tokens.append((name, span.text(), start, end))
+            states = states_from_grammar(
+                { 'word': (string.ascii_letters + '_',
+                           string.ascii_letters + '_'),
+                  'digit': (string.digits, string.digits)},
+                '()+*-', output)
+            tok = SpanScanner(states, lambda x, y: output('$', Span(buffer, 0, 0),
+                                                          x, y))
+            tok.consume_text(buffer)
+            tok.eof()
+            return tokens
+        for text in ['word10* +13) x', '', ' ', 'a\nbc \n\n 12\n', 'x  \n']:
+            expected = record(Scanner, [text])
+            assert(record_spans(text.encode()) == expected)
+            assert(record_spans(memoryview(text.encode())) == expected)
+        tok = SpanScanner(all_states, lambda x, y: None)
+        try:
+            tok.consume_text(b'a$')
+        except AssertionError:
+            pass
+        else:
+            assert(not 'Should have failed')
@@ -52,8 +52,10 @@
 #   - FOLLOW set (later to be associated with a specific itemset, but for now,
 #     with SLR, independent).
 
-from parse_grammar import get_rules, get_rules_and_tokens
+from parse_grammar import get_rules, get_rules_and_tokens, get_precedence
 import manual_tables
+import grammar_analysis
+import table_cache
 import enum
 from dataclasses import dataclass
 import collections
@@ -63,11 +65,6 @@ logger = logging.getLogger(__name__)
 
 # Rules are a dictionary of nonterminal: [expansion, ...]
 # Each expansion is the current List of expansions is all the possible expansions.
-def transitive_closure_mutable(init, update):
-    while update(init):
-        pass
-    return init
-
 def make_terminal_func(nonterminals):
     def terminal(tok):
         return tok not in nonterminals
@@ -76,96 +73,24 @@ def make_terminal_func(nonterminals):
 def all_nonterminals(rules):
     return set(rules.keys())
 
-####### Finding Nullable symbols.
-
-def known_nullable(sym, expansions, already_known):
-    if sym in already_known:
-        return True
-    def nullable_gen(gen):
-        return all(x in already_known for x in gen)
-    return any(nullable_gen(x) for x in expansions)
+# Nullable symbols, FIRST and FOLLOW are found by building the dependency graph
+# between nonterminals once and solving it over its strongly connected
+# components (see grammar_analysis.py).
 
+####### Finding Nullable symbols.
 def nullable_syms(rules):
-    def update_nullable(verified_nullable):
-        logger.debug('update_nullable: ' + str(verified_nullable))
-        ret = False
-        for key, val in rules.items():
-            if key in verified_nullable:
-                continue
-            if known_nullable(key, val, verified_nullable):
-                verified_nullable.add(key)
-                ret = True
-        return ret
-    return transitive_closure_mutable(set(), update_nullable)
-    
+    return grammar_analysis.nullable_syms(rules)
+
 #######  FIRST set.
-def first(rules, nullable):
+def first(rules, nullable, terminal):
     # At one point I was concerned that FIRST(x) could need FOLLOW to figure out.
     # I.e. when x is nullable.  I think this is not a problem since FIRST is only used in FOLLOW, so if I make sure to check for x being nullable when determining FOLLOW I shouldn't need to take it into account when defining FIRST.
     # Instead, FIRST just needs to find everything that *could* start a given nonterminal.  The possibility that a given nonterminal may expand to nothing doesn't need to be represented in this data structure.
-    SymStore = collections.namedtuple('SymStore', ['terminals', 'nonterminals'])
-    first_items = collections.defaultdict(lambda: SymStore(set(), set()))
-    for key, val in rules.items():
-        item = first_items[key]
-        for gen in val:
-            for sym in gen:
-                toupdate = item.terminals if terminal(sym) else item.nonterminals
-                toupdate.add(sym)
-                if sym not in nullable:
-                    break
-    def update_first(current_first):
-        ret = False
-        logger.debug('update_first: ' + str(current_first))
-        for key in rules:
-            this_first = current_first[key]
-            for nont in this_first.nonterminals:
-                that_first = current_first[nont]
-                if not this_first.terminals.issuperset(that_first.terminals):
-                    ret = True
-                    this_first.terminals.update(that_first.terminals)
-        return ret
-    finalised_first = transitive_closure_mutable(first_items, update_first)
-    return {key: val.terminals for key, val in finalised_first.items()}
+    return grammar_analysis.first(rules, nullable, terminal)
 
 ####### FOLLOW set
-def follow(rules, first, nullable, known):
-    SymStore = collections.namedtuple('SymStore', ['terminals', 'follow'])
-    follow_items = {key: SymStore(set(), set()) for key in rules}
-    for k, v in known.items():
-        follow_items[k].terminals.update(v)
-    for key, val in rules.items():
-        for gen in val:
-            update_list = []
-            for sym in gen:
-                for s in update_list:
-                    item = follow_items[s]
-                    if terminal(sym):
-                        item.terminals.add(sym)
-                    else:
-                        item.terminals.update(first[sym])
-                if terminal(sym):
-                    update_list = []
-                elif sym not in nullable:
-                    update_list = [sym]
-                else:
-                    update_list.append(sym)
-            # Above loop handles all up to last element, this handles
-            # everything "active" at end of rule.
-            for s in update_list:
-                item = follow_items[s]
-                item.follow.add(key)
-    def update_follow(current_follow):
-        logger.debug('update_follow: ' + str(current_follow))
-        ret = False
-        for key, this in current_follow.items():
-            for chain in this.follow:
-                that = current_follow[chain]
-                if not this.terminals.issuperset(that.terminals):
-                    ret = True
-                    this.terminals.update(that.terminals)
-        return ret
-    finalised_follow = transitive_closure_mutable(follow_items, update_follow)
-    return {k: v.terminals for k, v in finalised_follow.items()}
+def follow(rules, first, nullable, known, terminal):
+    return grammar_analysis.follow(rules, first, nullable, known, terminal)
     
 ####### Itemsets
 # Structure of an SLR itemset is:
@@ -201,12 +126,14 @@ def left_pad(text, padding):
     return '\n'.join(padding+x for x in text.splitlines())
 
 class StateStore:
-    def __init__(self, mapping, reduction_actions, shift_actions, accept_actions):
+    def __init__(self, mapping, reduction_actions, shift_actions, accept_actions,
+                 skipped_closures=0):
         self.state_to_num = mapping
         self.num_to_state = {v: k for k, v in mapping.items()}
         self.shift_actions = shift_actions
         self.reduction_actions = reduction_actions
         self.accept_actions = accept_actions
+        self.skipped_closures = skipped_closures
         assert(set(self.num_to_state.keys()) == set(range(len(mapping))))
     def __str__(self):
         chunks = [list() for _ in self.num_to_state]
@@ -221,7 +148,8 @@ class StateStore:
             if self.reduction_actions[v]:
                 chunks[k].append('  Reductions:')
                 for sym, pred in self.reduction_actions[v].items():
-                    chunks[k].append('    {}:  reduce({})'.format(sym, pred))
+                    chunks[k].append('    {}:  reduce({})'.format(
+                                        sym, pred if pred is not None else 'error'))
             if self.accept_actions[v]:
                 chunks[k].append('  Accept on:')
                 for sym in self.accept_actions[v]:
@@ -247,7 +175,27 @@ def extend_predictions(rules, predictions):
         tohandle.extend(x.next_sym() for x in extra)
     return predictions
 
-def actions_for(predictions, root_term, follow):
+####### Closure templates
+# `extend_predictions` walks `rules` for every kernel, rediscovering the same
+# expansions of the same handful of nonterminals each time.  Since the closure
+# of a nonterminal does not depend on where it was predicted from, we close
+# each nonterminal once up front and closing a kernel is then the union of the
+# templates for the symbols after its dots.
+def closure_templates(rules):
+    # N.b. `extend_predictions` adds empty entries to `rules` for terminals,
+    # which don't need a template.
+    nonterminals = [k for k, v in rules.items() if v]
+    return {sym: tuple(extend_predictions(
+                        rules, [Prediction(sym, tuple(x), 0) for x in rules[sym]]))
+            for sym in nonterminals}
+
+def close_kernel(templates, kernel):
+    predictions = list(kernel)
+    for sym in set(p.next_sym() for p in kernel):
+        predictions.extend(templates.get(sym, ()))
+    return predictions
+
+def actions_for(predictions, root_term, follow, precedence):
     ret = collections.defaultdict(list)
     reductions = {}
     accepts = set()
@@ -255,60 +203,71 @@ def actions_for(predictions, root_term, follow):
         sym = p.next_sym()
         if sym is None:
             for f in follow[p.key]:
-                # Early assertion error on shift/reduce conflict.
-                assert(f not in ret)
-                # Assertion error on reduce/reduce conflict.
-                assert(f not in reductions)
+                grammar_analysis.reduce_reduce(reductions, f, p)
                 if p.key == root_term:
                     accepts.add(f)
                 else:
                     reductions[f] = p
             continue
         ret[sym].append(p.shifted())
+    # Shift/reduce conflicts that precedence declarations don't resolve are
+    # left for the caller's `check_conflicts`.
+    grammar_analysis.resolve_conflicts(ret, reductions, precedence)
     return reductions, ret, accepts
 
 # N.b. I'm curious whether there is any way to determine where the start is
 # automatically.
-# Thoughts:
-#   - Hash on kernels rather than entire states?
-#     Should do essentially the same thing, but could save in "seen"
-#     before expanding (saving a bit of work).
-def itemlists(rules, root_term, follow):
+# States are recorded against their kernel (the shifted predictions) rather
+# than the entire itemset.  A state is determined by its kernel, so this gives
+# the same states while only expanding each distinct kernel once.
+# `skipped_closures` on the returned StateStore counts how many expansions
+# this avoided.
+# Each state is expanded once, so no GOTO(state, symbol) is ever worked out
+# twice and there is nothing for a memo of them to save: the repeated work is
+# closing the same kernel reached along another path, which this avoids.
+def itemlists(rules, root_term, follow, precedence={}):
     # Approach:
     #  1) Expand all implicit states from the beginning of root_term.
     #     - This gives the first itemlist.
     #  2) For each symbol in any "next" position:
     #     - Create the kernel of a new itemset.
     #     - Expand all implicit states.
-    predictions = [Prediction(root_term, tuple(x), 0) for x in rules[root_term]]
-    extend_predictions(rules, predictions)
-    start = ItemSet.from_iterable(predictions)
-    counter = 0
-    seen = {}
-    tohandle = [start]
+    templates = closure_templates(rules)
+    def closure(kernel):
+        return ItemSet.from_iterable(close_kernel(templates, kernel))
+    start = ItemSet.from_iterable(Prediction(root_term, tuple(x), 0)
+                                  for x in rules[root_term])
+    kernels = {start: 0}
+    states = [closure(start)]
+    skipped_closures = 0
+    tohandle = [0]
     shift_actions = {}
     reduction_actions = {}
     accept_actions = {}
+    def successor(shifted):
+        nonlocal skipped_closures
+        kernel = ItemSet.from_iterable(shifted)
+        if kernel in kernels:
+            skipped_closures += 1
+        else:
+            kernels[kernel] = len(states)
+            states.append(closure(kernel))
+            tohandle.append(kernels[kernel])
+        return kernels[kernel]
     while tohandle:
-        s = tohandle.pop()
-        if s in seen:
-            continue
-        seen[s] = counter
-        counter += 1
-        reductions, shifts, accepts = actions_for(s.predictions, root_term, follow)
+        num = tohandle.pop()
+        s = states[num]
+        reductions, shifts, accepts = actions_for(s.predictions, root_term,
+                                                  follow, precedence)
         for sym in shifts:
-            extend_predictions(rules, shifts[sym])
-            toadd = ItemSet.from_iterable(shifts[sym])
-            shifts[sym] = toadd
-            if toadd not in seen:
-                tohandle.append(toadd)
-        # Assertion error on reduce/shift conflict.
-        assert(not any(x in reductions for x in shifts))
-        assert(not any(x in reductions for x in accepts))
-        assert(not any(y in shifts for y in accepts))
+            shifts[sym] = states[successor(shifts[sym])]
+        grammar_analysis.check_conflicts(shifts, reductions, accepts)
         reduction_actions[s], shift_actions[s], accept_actions[s] = (
                 reductions, shifts, accepts)
-    return StateStore(seen, reduction_actions, shift_actions, accept_actions)
+    logger.info('Skipped closures: {}'.format(skipped_closures))
+    seen = {s: num for num, s in enumerate(states)}
+    return StateStore(seen, reduction_actions, shift_actions, accept_actions,
+                      skipped_closures)
 
 ######### Using that action table to parse.
 def convert_to_action_table(state_store, root_term):
@@ -316,37 +275,44 @@ def convert_to_action_table(state_store, root_term):
     for k, v in state_store.num_to_state.items():
         shifts = {sym: manual_tables.shift(state_store.state_to_num[next_state])
                   for sym, next_state in state_store.shift_actions[v].items()}
+        # A reduction of None is an error from `%nonassoc`.
         reductions = {sym: manual_tables.red(len(p.gen), p.key)
+                           if p is not None else manual_tables.error()
                         for sym, p in state_store.reduction_actions[v].items()}
         accepts = {sym: manual_tables.accept() for sym in state_store.accept_actions[v]}
-        assert(not any(x in shifts for x in reductions))
-        assert(not any(x in accepts for x in reductions))
-        assert(not any(y in shifts for y in accepts))
+        grammar_analysis.check_conflicts(shifts, reductions, accepts)
         actions = shifts
         actions.update(reductions)
         actions.update(accepts)
         action_tables[k] = actions
     assert(None not in action_tables)
-    return action_tables
+    return manual_tables.use_default_reductions(action_tables)
+
+def generate_states(rules, nonterminals, FOLLOW, precedence):
+    '''SLR states for `rules`, whose FOLLOW sets are already known (e.g. from
+    the analysis `canonical_lr_generator` shares between algorithms).'''
+    states = itemlists(rules, 'Start', FOLLOW, precedence)
+    logger.info('States: ' + str(states))
+    return states
 
 def generate_action_tables(grammar_filename):
-    global terminal
     with open(grammar_filename) as infile:
         text = infile.read()
     all_rules = get_rules(text)
+    precedence = get_precedence(text)
     logger.info('Initial rules: ' + str(all_rules))
     nullable = nullable_syms(all_rules)
     logger.info('Nullable: ' + str(nullable))
     nonterminals = all_nonterminals(all_rules)
     logger.info('Nonterminals: ' + str(nonterminals))
     terminal = make_terminal_func(nonterminals)
-    FIRST = first(all_rules, nullable)
+    FIRST = first(all_rules, nullable, terminal)
     logger.info('FIRST: ' + str(FIRST))
-    FOLLOW = follow(all_rules, FIRST, nullable, {'Start': ['$']})
+    FOLLOW = follow(all_rules, FIRST, nullable, {'Start': ['$']}, terminal)
     logger.info('FOLLOW: ' + str(FOLLOW))
-    states = itemlists(all_rules, 'Start', FOLLOW)
-    logger.info('States: ' + str(states))
-    return convert_to_action_table(states, 'Start')
+    states = generate_states(all_rules, nonterminals, FOLLOW, precedence)
+    action_tables = convert_to_action_table(states, 'Start')
+    return action_tables
 
 def get_tokenizer(grammar_filename):
     with open(grammar_filename) as infile:
@@ -354,8 +320,12 @@ def get_tokenizer(grammar_filename):
     _, named_tokens, unnamed_tokens = get_rules_and_tokens(text)
     return parsing_from_text.ParametrisedTokenizer(named_tokens, unnamed_tokens)
 
-def initialise_actions(grammar_filename):
-    action_table = generate_action_tables(grammar_filename)
+def initialise_actions(grammar_filename, use_cache=False):
+    if use_cache:
+        action_table = table_cache.cached_action_tables(
+                grammar_filename, __file__, generate_action_tables)
+    else:
+        action_table = generate_action_tables(grammar_filename)
     manual_tables.initialise_actions(action_table)
 
 if __name__ == '__main__':
@@ -373,11 +343,24 @@ if __name__ == '__main__':
     else:
         try:
             initialise_actions('slr_lr_grammar.txt')
-        except AssertionError:
+        except grammar_analysis.GrammarConflict:
             pass
         else:
             assert(not 'Should have failed to generate grammar! (is not SLR)')
         initialise_actions('tutorial-grammar.txt')
+        # Every transition either makes a new state or reuses one whose kernel
+        # was already closed.
+        with open('tutorial-grammar.txt') as infile:
+            rules = get_rules(infile.read())
+        terminal = make_terminal_func(all_nonterminals(rules))
+        nullable = nullable_syms(rules)
+        states = itemlists(rules, 'Start',
+                           follow(rules, first(rules, nullable, terminal),
+                                  nullable, {'Start': ['$']}, terminal))
+        transitions = sum(len(x) for x in states.shift_actions.values())
+        assert(states.skipped_closures
+               == transitions - (len(states.state_to_num) - 1))
+        assert(states.skipped_closures > 0)
         tokenizer = get_tokenizer('tutorial-grammar.txt')
         parsed_expression = parsing_from_text.general_parse_from_string(
                                 'n * (4+5)*3 + somename', tokenizer)
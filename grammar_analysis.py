@@ -0,0 +1,248 @@
+# Grammar analysis shared between the generators.
+#
+# The generators originally found nullable symbols, FIRST and FOLLOW sets by
+# sweeping over every rule until nothing changed.  With long chains of
+# nonterminals (e.g. many levels of precedence) that takes a sweep per link in
+# the chain.
+#
+# FIRST and FOLLOW (and the lookahead sets used in LR(1) closures and LALR
+# generation) are all of the form
+#     F(x) = initial(x) + F(y) for every y that x depends on,
+# so we build the dependency graph once and solve it with the `digraph`
+# algorithm from DeRemer & Pennello.  That is Tarjan's strongly connected
+# components algorithm, where every member of a component gets the same set
+# and each component is finished once its successors are.  Each edge is
+# visited once.
+#
+# Nullable symbols are not a union over a graph (a production is only
+# nullable when *all* its symbols are), so for those we keep a count of
+# not-yet-nullable symbols in each production instead.
+
+import collections
+import copy
+import logging
+logger = logging.getLogger(__name__)
+
+def digraph(nodes, edges, initial):
+    '''The `digraph` algorithm from DeRemer & Pennello.
+    Find F(x) = initial[x] + F(y) for all y reachable from x through `edges`.
+    `initial` needs an entry for every node.  Values can be sets or int
+    bitmasks (anything supporting `|=`), and are copied rather than modified.
+    Nodes in the same strongly connected component share the same value.
+    Written iteratively so that long chains in large grammars do not hit the
+    recursion limit.'''
+    INFINITY = float('inf')
+    depth = dict.fromkeys(nodes, 0)
+    result = {x: copy.copy(initial[x]) for x in nodes}
+    stack = []
+    for root in nodes:
+        if depth[root]:
+            continue
+        stack.append(root)
+        depth[root] = len(stack)
+        work = [(root, len(stack), iter(edges.get(root, ())))]
+        while work:
+            x, d, children = work[-1]
+            for y in children:
+                if depth[y] == 0:
+                    stack.append(y)
+                    depth[y] = len(stack)
+                    work.append((y, len(stack), iter(edges.get(y, ()))))
+                    break
+                depth[x] = min(depth[x], depth[y])
+                result[x] |= result[y]
+            else:
+                work.pop()
+                if depth[x] == d:
+                    while True:
+                        top = stack.pop()
+                        depth[top] = INFINITY
+                        result[top] = result[x]
+                        if top == x:
+                            break
+                if work:
+                    parent = work[-1][0]
+                    depth[parent] = min(depth[parent], depth[x])
+                    result[parent] |= result[x]
+    return result
+
+####### Finding Nullable symbols.
+def nullable_syms(rules):
+    '''Set of nonterminals which can expand to nothing.
+    Each production keeps a count of its symbols not yet known to be nullable.
+    When a symbol is found to be nullable the count of every production using
+    it goes down, and a production reaching zero makes its nonterminal
+    nullable.'''
+    remaining = []
+    produces = []
+    uses = collections.defaultdict(list)
+    tohandle = []
+    for key, gens in rules.items():
+        for gen in gens:
+            prod = len(produces)
+            produces.append(key)
+            remaining.append(len(gen))
+            for sym in gen:
+                uses[sym].append(prod)
+            if not gen:
+                tohandle.append(key)
+    nullable = set()
+    while tohandle:
+        sym = tohandle.pop()
+        if sym in nullable:
+            continue
+        nullable.add(sym)
+        for prod in uses[sym]:
+            remaining[prod] -= 1
+            if remaining[prod] == 0:
+                tohandle.append(produces[prod])
+    return nullable
+
+#######  FIRST set.
+def first(rules, nullable, terminal):
+    '''Map of nonterminal to the terminals which could start it.
+    As in the generators, whether a nonterminal is nullable is not recorded.'''
+    direct = {key: set() for key in rules}
+    starts_with = {key: [] for key in rules}
+    for key, gens in rules.items():
+        for gen in gens:
+            for sym in gen:
+                if terminal(sym):
+                    direct[key].add(sym)
+                else:
+                    starts_with[key].append(sym)
+                if sym not in nullable:
+                    break
+    return digraph(list(rules), starts_with, direct)
+
+####### FOLLOW set
+def follow(rules, first, nullable, known, terminal):
+    '''Map of nonterminal to the terminals which could follow it anywhere in
+    the grammar.  `known` gives extra terminals for some nonterminals (i.e. the
+    end marker following the start symbol).'''
+    terminals = {key: set(known.get(key, ())) for key in rules}
+    ends = {key: [] for key in rules}
+    for key, gens in rules.items():
+        for gen in gens:
+            update_list = []
+            for sym in gen:
+                toadd = [sym] if terminal(sym) else first[sym]
+                for s in update_list:
+                    terminals[s].update(toadd)
+                if terminal(sym):
+                    update_list = []
+                elif sym not in nullable:
+                    update_list = [sym]
+                else:
+                    update_list.append(sym)
+            # Anything still "active" at the end of the rule can be followed by
+            # whatever follows this rule.
+            for s in update_list:
+                ends[s].append(key)
+    return digraph(list(rules), ends, terminals)
+
+####### Conflicts
+class GrammarConflict(AssertionError):
+    '''A state of the generated automaton has more than one action for a
+    symbol, so the grammar needs a more powerful algorithm (or isn't LR(1)).
+    Raised explicitly rather than by `assert` so that it still happens under
+    `python -O`; an AssertionError so callers catching those still work.'''
+
+def reduce_reduce(reductions, sym, prediction, describe=str):
+    '''Raise GrammarConflict if `sym` already reduces by another production.
+    Predictions are shown in the message with `describe`.'''
+    if sym in reductions:
+        raise GrammarConflict('reduce/reduce conflict on {!r}: {} and {}'.format(
+                sym, describe(reductions[sym]), describe(prediction)))
+
+def check_conflicts(shifts, reductions, accepts, describe=str):
+    '''Raise GrammarConflict if a symbol is in more than one of `shifts`,
+    `reductions` and `accepts` (e.g. after `resolve_conflicts`).'''
+    for sym in reductions:
+        if sym in shifts or sym in accepts:
+            raise GrammarConflict('shift/reduce conflict on {!r}: {}'.format(
+                    sym, describe(reductions[sym])))
+    for sym in accepts:
+        if sym in shifts:
+            raise GrammarConflict('shift/accept conflict on {!r}'.format(sym))
+
+####### Precedence
+def production_precedence(gen, precedence):
+    '''As in yacc, a production has the precedence of its last terminal with
+    one (or None).'''
+    for sym in reversed(gen):
+        if sym in precedence:
+            return precedence[sym]
+    return None
+
+def resolve_conflicts(shifts, reductions, precedence):
+    '''Resolve shift/reduce conflicts with precedence declarations
+    ({terminal: (level, associativity)}, see `parse_grammar.get_precedence`).
+    `shifts` is {symbol: anything} and `reductions` is {terminal: Prediction},
+    and the losing action is removed from one or the other.
+    Where `%nonassoc` makes the terminal an error both are removed, and the
+    reduction is replaced by None to mark the error.
+    Conflicts without precedence on both sides are left as they are, for
+    `check_conflicts`.'''
+    for sym in [x for x in reductions if x in shifts]:
+        if reductions[sym] is None or sym not in precedence:
+            continue
+        rule = production_precedence(reductions[sym].gen, precedence)
+        if rule is None:
+            continue
+        level, assoc = precedence[sym]
+        if level > rule[0] or (level == rule[0] and assoc == 'right'):
+            del reductions[sym]
+        elif level < rule[0] or assoc == 'left':
+            del shifts[sym]
+        else:
+            del shifts[sym]
+            reductions[sym] = None
+
+if __name__ == '__main__':
+    import default_log_arg
+    from parse_grammar import get_rules
+    default_log_arg.do_default_logarg()
+    with open('tutorial-grammar.txt') as infile:
+        rules = get_rules(infile.read())
+    def terminal(sym):
+        return sym not in rules
+    nullable = nullable_syms(rules)
+    assert(nullable == {'Minus'})
+    FIRST = first(rules, nullable, terminal)
+    assert(FIRST == {'Start': {'(', '-', 'int', 'name'},
+                     'Add': {'(', '-', 'int', 'name'},
+                     'Factor': {'(', '-', 'int', 'name'},
+                     'Term': {'(', '-', 'int', 'name'},
+                     'Minus': {'-'}})
+    FOLLOW = follow(rules, FIRST, nullable, {'Start': ['$']}, terminal)
+    assert(FOLLOW == {'Start': {'$'},
+                      'Add': {'$', '+', ')'},
+                      'Factor': {'$', '+', ')', '*'},
+                      'Term': {'$', '+', ')', '*'},
+                      'Minus': {'(', 'int', 'name'}})
+
+    # Cycles are solved in one go, and bitmasks work as well as sets.
+    result = digraph(['a', 'b', 'c', 'd'],
+                     {'a': ['b'], 'b': ['c'], 'c': ['a', 'd']},
+                     {'a': 1, 'b': 2, 'c': 4, 'd': 8})
+    assert(result == {'a': 15, 'b': 15, 'c': 15, 'd': 8})
+    # Chains of nullable symbols.
+    assert(nullable_syms({'A': [['B', 'C']], 'B': [['C'], ['x']], 'C': [[]],
+                          'D': [['A', 'y']]})
+           == {'A', 'B', 'C'})
+
+    # Shift/reduce conflicts on E -> E op E . with op next.
+    class Rule:
+        def __init__(self, gen):
+            self.gen = gen
+    precedence = {'+': (1, 'left'), '*': (2, 'left'), '^': (3, 'right'),
+                  '<': (0, 'nonassoc')}
+    shifts = {'+': 1, '*': 2, '^': 3, '<': 4, 'x': 5}
+    reductions = {'+': Rule(['E', '*', 'E']), '*': Rule(['E', '+', 'E']),
+                  '^': Rule(['E', '^', 'E']), '<': Rule(['E', '<', 'E']),
+                  '$': Rule(['E', '+', 'E']), 'x': Rule(['E', 'y'])}
+    resolve_conflicts(shifts, reductions, precedence)
+    assert(shifts == {'*': 2, '^': 3, 'x': 5})
+    assert(sorted(reductions) == ['$', '+', '<', 'x'])
+    assert(reductions['<'] is None)
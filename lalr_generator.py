@@ -0,0 +1,200 @@
+# LALR(1) tables using the DeRemer & Pennello lookahead computation.
+#
+# Rather than building canonical LR(1) item sets (which gives a new state for
+# every distinct combination of lookaheads) we build the LR(0) automaton once,
+# exactly as the SLR generator does, and then work out the lookahead set of
+# each reduction from relations between the *nonterminal transitions* of that
+# automaton.  A nonterminal transition is written (p, A) -- the transition out
+# of state p on nonterminal A.
+#
+#   - DR(p, A):  Terminals that can be shifted directly from the state we
+#                reach after (p, A).
+#   - reads:     (p, A) reads (r, C)  iff  p --A--> r --C--> and C is nullable.
+#   - includes:  (p, A) includes (p', B)  iff  B -> beta A gamma, where gamma
+#                is nullable and p' --beta--> p.
+#   - lookback:  (q, A -> w) lookback (p, A)  iff  p --w--> q.
+#
+#   Read(p, A)   = DR(p, A) + Read(r, C) for all (r, C) that (p, A) reads.
+#   Follow(p, A) = Read(p, A) + Follow(p', B) for all (p', B) it includes.
+#   LA(q, A -> w) = Follow(p, A) for all (p, A) that (q, A -> w) looks back to.
+#
+# Both Read and Follow are found with the `digraph` algorithm from the paper
+# (in grammar_analysis.py), which handles cycles in the relations by giving
+# every member of a strongly connected component the same set.
+#
+# The start symbol does not have a transition out of state 0 (unless it is
+# used on the right hand side of some rule), so we add a pseudo-transition
+# (0, root_term) whose DR set is the root follow set (i.e. '$').
+
+import generator_take2
+import grammar_analysis
+from grammar_analysis import digraph
+from generator_take2 import Prediction, ItemSet, StateStore
+import collections
+import logging
+logger = logging.getLogger(__name__)
+
+def lr0_itemlists(rules, root_term):
+    '''Build the LR(0) automaton.
+    Returns the list of states (index is state number) and the transitions out
+    of each state as a list of {symbol: state number}.
+    As in `generator_take2.itemlists`, states are recorded by their kernel so
+    each kernel is only expanded once.'''
+    templates = generator_take2.closure_templates(rules)
+    def closure(kernel):
+        return ItemSet.from_iterable(
+                generator_take2.close_kernel(templates, kernel))
+    start = ItemSet.from_iterable(Prediction(root_term, tuple(x), 0)
+                                  for x in rules[root_term])
+    seen = {start: 0}
+    states = [closure(start)]
+    goto = []
+    while len(goto) < len(states):
+        s = states[len(goto)]
+        shifts = collections.defaultdict(list)
+        for p in s:
+            sym = p.next_sym()
+            if sym is not None:
+                shifts[sym].append(p.shifted())
+        transitions = {}
+        for sym in sorted(shifts):
+            kernel = ItemSet.from_iterable(shifts[sym])
+            if kernel not in seen:
+                seen[kernel] = len(states)
+                states.append(closure(kernel))
+            transitions[sym] = seen[kernel]
+        goto.append(transitions)
+    return states, goto
+
+def lalr_lookaheads(rules, nonterminals, root_term, root_follow, nullable,
+                    goto):
+    '''Return {(state number, completed Prediction): lookahead set}.'''
+    def nonterminal(sym):
+        return sym in nonterminals
+    transitions = [(p, sym) for p, trans in enumerate(goto)
+                   for sym in trans if nonterminal(sym)]
+    if (0, root_term) not in transitions:
+        transitions.append((0, root_term))
+    direct_reads = {}
+    reads = {}
+    for p, A in transitions:
+        r = goto[p].get(A)
+        following = goto[r] if r is not None else {}
+        direct_reads[(p, A)] = set(x for x in following if not nonterminal(x))
+        reads[(p, A)] = [(r, C) for C in following
+                         if nonterminal(C) and C in nullable]
+    direct_reads[(0, root_term)].update(root_follow)
+    logger.debug('DR: {}'.format(direct_reads))
+    logger.debug('reads: {}'.format(reads))
+
+    includes = collections.defaultdict(list)
+    lookback = collections.defaultdict(list)
+    for p, B in transitions:
+        for gen in rules[B]:
+            state = p
+            for idx, sym in enumerate(gen):
+                if nonterminal(sym) and all(x in nullable for x in gen[idx+1:]):
+                    includes[(state, sym)].append((p, B))
+                state = goto[state][sym]
+            lookback[(state, Prediction(B, tuple(gen), len(gen)))].append((p, B))
+    logger.debug('includes: {}'.format(dict(includes)))
+    logger.debug('lookback: {}'.format(dict(lookback)))
+
+    read_sets = digraph(transitions, reads, direct_reads)
+    follow_sets = digraph(transitions, includes, read_sets)
+    logger.info('LALR Follow: {}'.format(follow_sets))
+    lookaheads = {}
+    for key, looks in lookback.items():
+        lookaheads[key] = set().union(*(follow_sets[x] for x in looks))
+    return lookaheads
+
+def itemlists(rules, root_term, root_follow, nullable, precedence={}):
+    '''LALR(1) equivalent of `generator_take2.itemlists`.
+    Returns a `generator_take2.StateStore` so the result can be passed to the
+    same `convert_to_action_table` functions as the other generators.'''
+    # N.b. `extend_predictions` adds empty entries to `rules` for terminals, so
+    # take the set of nonterminals before building the automaton.
+    nonterminals = set(rules.keys())
+    states, goto = lr0_itemlists(rules, root_term)
+    lookaheads = lalr_lookaheads(rules, nonterminals, root_term, root_follow,
+                                 nullable, goto)
+    shift_actions = {}
+    reduction_actions = {}
+    accept_actions = {}
+    for num, s in enumerate(states):
+        shifts = {sym: states[target] for sym, target in goto[num].items()}
+        reductions = {}
+        accepts = set()
+        for p in s:
+            if p.next_sym() is not None:
+                continue
+            for f in lookaheads.get((num, p), ()):
+                grammar_analysis.reduce_reduce(reductions, f, p)
+                if p.key == root_term:
+                    accepts.add(f)
+                else:
+                    reductions[f] = p
+        grammar_analysis.resolve_conflicts(shifts, reductions, precedence)
+        grammar_analysis.check_conflicts(shifts, reductions, accepts)
+        reduction_actions[s], shift_actions[s], accept_actions[s] = (
+                reductions, shifts, accepts)
+    mapping = {s: num for num, s in enumerate(states)}
+    return StateStore(mapping, reduction_actions, shift_actions, accept_actions)
+
+if __name__ == '__main__':
+    import pprint
+    import sys
+    import default_log_arg
+    import argparse
+    import parsing_from_text
+    import canonical_lr_generator
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--grammar', default='slr_lr_grammar.txt')
+    args = default_log_arg.add_default_logarg(parser)
+    text = sys.stdin.read()
+    if text:
+        canonical_lr_generator.initialise_actions(args.grammar, 'lalr')
+        tokenizer = canonical_lr_generator.get_tokenizer(args.grammar)
+        parsed_expression = parsing_from_text.general_parse_from_string(
+                                text, tokenizer)
+        pprint.pprint(parsed_expression)
+    else:
+        # Not SLR, but is LALR.
+        canonical_lr_generator.initialise_actions('slr_lr_grammar.txt', 'lalr')
+        tokenizer = canonical_lr_generator.get_tokenizer('slr_lr_grammar.txt')
+        parsed_expression = parsing_from_text.general_parse_from_string(
+                                'b m ef', tokenizer)
+        assert(parsed_expression == ['b', [':B', [':L', 'm'], 'e'], 'f'])
+        parsed_expression = parsing_from_text.general_parse_from_string(
+                                'a n f e', tokenizer)
+        assert(parsed_expression == ['a', [':A', [':L', 'n'], 'f'], 'e'])
+
+        # LALR tables should be the same size as the SLR tables (the numbering
+        # of states differs), and give the same parse as the canonical tables.
+        lalr_table = canonical_lr_generator.generate_action_tables(
+                        'tutorial-grammar.txt', 'lalr')
+        slr_table = generator_take2.generate_action_tables(
+                        'tutorial-grammar.txt')
+        assert(len(lalr_table) == len(slr_table))
+        assert(sorted(sorted(x) for x in lalr_table) ==
+               sorted(sorted(x) for x in slr_table))
+        tokenizer = canonical_lr_generator.get_tokenizer('tutorial-grammar.txt')
+        test_input = 'n * (4+5)*3 + -somename'
+        canonical_lr_generator.initialise_actions('tutorial-grammar.txt')
+        canonical_expression = parsing_from_text.general_parse_from_string(
+                                    test_input, tokenizer)
+        canonical_lr_generator.initialise_actions('tutorial-grammar.txt', 'lalr')
+        lalr_expression = parsing_from_text.general_parse_from_string(
+                                    test_input, tokenizer)
+        assert(canonical_expression == lalr_expression)
+
+        # LR(1), but merging states with the same core introduces a
+        # reduce/reduce conflict.
+        canonical_lr_generator.generate_action_tables('lr_not_lalr_grammar.txt')
+        try:
+            canonical_lr_generator.generate_action_tables(
+                    'lr_not_lalr_grammar.txt', 'lalr')
+        except grammar_analysis.GrammarConflict:
+            pass
+        else:
+            assert(not 'Should have failed to generate grammar! (is not LALR)')
@@ -3,15 +3,112 @@ import logging
 logger = logging.getLogger(__name__)
 
 class State:
-    def __init__(self):
+    def __init__(self, tables=None):
         self.accepted_expressions = []
         self.stack = []
         self.forest = []
         self.top = 0
+        # Each parse keeps the tables it uses, so parses with different tables
+        # can run at the same time.  By default, those last given to
+        # `initialise_actions`.
+        self.action_table = tables if tables is not None else action_table
+
+def error():
+    '''Explicit syntax error, e.g. from `%nonassoc`.  Errors are usually left
+    out of the tables, but an explicit one stops a row being turned into a
+    default reduction.'''
+    def _error_(st, value):
+        raise KeyError('Syntax error at {!r} in state {}'.format(value, st.top))
+    _error_.action = ('error',)
+    return _error_
+
+# Key for a reduction made whatever the next symbol is.  Grammar symbols are
+# split on whitespace, so none of them is empty.
+DEFAULT_REDUCTION = ''
+
+def lookup(row, symbol):
+    action = row.get(symbol)
+    return action if action is not None else row[DEFAULT_REDUCTION]
 
 def advance(st, next_symbol, value):
-    while action_table[st.top][next_symbol](st, value):
+    while lookup(st.action_table[st.top], next_symbol)(st, value):
         pass
+    reduce_defaults(st)
+
+def shifts(st, symbol):
+    '''Whether `advance(st, symbol, ...)` would get as far as shifting (or
+    accepting) `symbol` rather than failing.  Worked out from what the actions
+    do (their `action` attributes), leaving `st` as it is.'''
+    return run_steps(shifting(st, symbol))
+
+def reduce_defaults(st):
+    '''Make the reductions of states with nothing but a default reduction.
+    These don't depend on the next symbol, so are made as soon as we reach the
+    state instead of when the next token arrives.'''
+    row = st.action_table[st.top]
+    while len(row) == 1 and DEFAULT_REDUCTION in row:
+        row[DEFAULT_REDUCTION](st, None)
+        row = st.action_table[st.top]
+
+####### Advancing a step at a time
+# One token can set off any number of reductions (e.g. the end of a long
+# right associative chain `a ^ b ^ ... ^ z`).  These generators do the same as
+# `advance` and `shifts`, yielding after each action so that the caller can
+# spread that work out, e.g. between other tasks (see `async_parsing`).
+def advancing(st, next_symbol, value):
+    '''As `advance`, yielding after each action.'''
+    while lookup(st.action_table[st.top], next_symbol)(st, value):
+        yield
+    yield
+    row = st.action_table[st.top]
+    while len(row) == 1 and DEFAULT_REDUCTION in row:
+        row[DEFAULT_REDUCTION](st, None)
+        yield
+        row = st.action_table[st.top]
+
+def run_steps(steps):
+    '''Run the generator `steps` to the end, returning what it returns.'''
+    try:
+        while True:
+            next(steps)
+    except StopIteration as done:
+        return done.value
+
+def shifting(st, symbol):
+    '''As `shifts`, yielding after each reduction it works through.'''
+    table = st.action_table
+    top = st.top
+    # The stack as it would be: `st.stack[:depth]` then `pushed`.
+    depth = len(st.stack)
+    pushed = []
+    while True:
+        row = table[top]
+        action = row.get(symbol)
+        if action is None:
+            action = row.get(DEFAULT_REDUCTION)
+        if action is None:
+            return False
+        if action.action[0] != 'red':
+            return action.action[0] != 'error'
+        _, count, lhs = action.action
+        for _ in range(count):
+            if pushed:
+                top = pushed.pop()
+            else:
+                depth -= 1
+                top = st.stack[depth]
+        pushed.append(top)
+        top = table[top][lhs].action[1]
+        yield
+
+def use_default_reductions(action_tables):
+    '''Replace the rows of states that only reduce by one production (e.g.
+    `Term -> name .`) with a single default reduction.'''
+    for num, row in enumerate(action_tables):
+        actions = set(x.action for x in row.values())
+        if len(actions) == 1 and next(iter(actions))[0] == 'red':
+            action_tables[num] = {DEFAULT_REDUCTION: next(iter(row.values()))}
+    return action_tables
 
 def shift(to):
     def _shift_(st, value):
@@ -20,6 +117,8 @@ def shift(to):
         st.forest.append(value)
         st.top = to
         return False
+    # What this action does, so that tables can be stored (see table_cache).
+    _shift_.action = ('shift', to)
     return _shift_
 
 def red(count, symbol):
@@ -32,8 +131,9 @@ def red(count, symbol):
         args.append(':' + name)
         args.reverse()
         logger.debug('reduce {}'.format(symbol))
-        action_table[st.top][symbol](st, args)
+        st.action_table[st.top][symbol](st, args)
         return True
+    _red_.action = ('red', count, symbol)
     return _red_
 
 def accept():
@@ -41,9 +141,12 @@ def accept():
         st.top = st.stack.pop()
         st.accepted_expressions.append(st.forest)
         assert(len(st.accepted_expressions) == 1)
-        logger.debug('Accepted: {}'.format(
-                        pprint.pformat(st.accepted_expressions[0])))
+        # Formatting the whole tree would make the text of every span.
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Accepted: {}'.format(
+                            pprint.pformat(st.accepted_expressions[0])))
         return False
+    _accept_.action = ('accept',)
     return _accept_
 
 default_action_table = [
@@ -128,8 +231,11 @@ default_action_table = [
         }]
 
 def initialise_actions(alt_actions):
+    '''Parse with `alt_actions`, or the tables above if None.  Tables may be
+    empty until used (e.g. `canonical_lr_generator.LazyActionTable`), so only
+    None means the default.'''
     global action_table
-    if alt_actions:
+    if alt_actions is not None:
         action_table = alt_actions
     else:
         action_table = default_action_table
@@ -172,3 +278,13 @@ if __name__ == '__main__':
         pass
     else:
         assert(not 'Should have failed with unexpected end of input')
+
+    # Whether a symbol would be shifted is known without changing the state.
+    st = State()
+    for symbol in ['(', 'name', '+', 'int']:
+        advance(st, symbol, symbol)
+    stack, forest, top = list(st.stack), list(st.forest), st.top
+    assert(shifts(st, ')') and shifts(st, '*') and shifts(st, '+'))
+    assert(not shifts(st, '$') and not shifts(st, 'name')
+           and not shifts(st, '('))
+    assert((st.stack, st.forest, st.top) == (stack, forest, top))
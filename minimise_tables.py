@@ -0,0 +1,97 @@
+'''Merge equivalent states of generated action tables.
+
+Two states are equivalent if on every symbol they do the same thing: the same
+reduction, accept, error, or a shift/goto to equivalent states.  Canonical
+LR(1) tables in particular have many such states, e.g. states that differ only
+in the lookaheads of items that never get reduced there, or states that (with
+default reductions) reduce the same production whatever the lookahead.
+
+We find the equivalence classes by partition refinement, as in DFA
+minimisation.  Start with states split by everything except where their shifts
+go, then repeatedly split blocks whose members shift into different blocks
+until nothing changes.  Merged states accept the same language and build the
+same trees, since every action taken is the same.
+'''
+import table_cache
+import logging
+logger = logging.getLogger(__name__)
+
+def row_signature(row, block_of):
+    '''What a state does on each symbol, with shift targets given by the
+    block they are in.'''
+    return tuple(sorted((sym, ('shift', block_of[desc[1]]) if desc[0] == 'shift'
+                               else desc)
+                        for sym, desc in row.items()))
+
+def equivalent_states(descriptions):
+    '''List mapping each state to its equivalence class.  Classes are numbered
+    in order of their first state, so the start state stays 0.'''
+    block_of = [0] * len(descriptions)
+    num_blocks = 1
+    while True:
+        # Including the current block keeps earlier splits.
+        signatures = {}
+        new_block_of = [signatures.setdefault(
+                            (block_of[num], row_signature(row, block_of)),
+                            len(signatures))
+                        for num, row in enumerate(descriptions)]
+        block_of = new_block_of
+        if len(signatures) == num_blocks:
+            return block_of
+        num_blocks = len(signatures)
+
+def minimise_descriptions(descriptions):
+    block_of = equivalent_states(descriptions)
+    merged = [None] * (max(block_of) + 1 if block_of else 0)
+    for num, row in enumerate(descriptions):
+        if merged[block_of[num]] is None:
+            merged[block_of[num]] = {
+                sym: ('shift', block_of[desc[1]]) if desc[0] == 'shift' else desc
+                for sym, desc in row.items()}
+    logger.info('Minimised {} states to {}'.format(len(descriptions),
+                                                    len(merged)))
+    return merged
+
+def minimise_action_tables(action_tables):
+    '''Equivalent of `action_tables` with equivalent states merged.'''
+    return table_cache.build_tables(minimise_descriptions(
+                table_cache.describe_tables(action_tables)))
+
+if __name__ == '__main__':
+    import default_log_arg
+    import manual_tables
+    import parsing_from_text
+    import canonical_lr_generator
+    default_log_arg.do_default_logarg()
+    # States 1 and 2 only differ in shifting to the equivalent 3 and 4.
+    descriptions = [{'a': ('shift', 1), 'b': ('shift', 2)},
+                    {'c': ('shift', 3)},
+                    {'c': ('shift', 4)},
+                    {'$': ('red', 2, 'X')},
+                    {'$': ('red', 2, 'X')},
+                    {'$': ('accept',)}]
+    assert(equivalent_states(descriptions) == [0, 1, 1, 2, 2, 3])
+    assert(minimise_descriptions(descriptions) ==
+           [{'a': ('shift', 1), 'b': ('shift', 1)},
+            {'c': ('shift', 2)},
+            {'$': ('red', 2, 'X')},
+            {'$': ('accept',)}])
+    # Shifting to different reductions keeps states apart.
+    descriptions[4] = {'$': ('red', 2, 'Y')}
+    assert(equivalent_states(descriptions) == [0, 1, 2, 3, 4, 5])
+
+    for grammar, inputs in [
+            ('tutorial-grammar.txt',
+             ['n * (4+5)*3 + -somename', '1', '-(a+b)*c']),
+            ('lr_not_lalr_grammar.txt', ['a e c', 'b e d'])]:
+        action_tables = canonical_lr_generator.generate_action_tables(grammar)
+        minimised = minimise_action_tables(action_tables)
+        assert(len(minimised) < len(action_tables))
+        tokenizer = canonical_lr_generator.get_tokenizer(grammar)
+        for text in inputs:
+            manual_tables.initialise_actions(action_tables)
+            expected = parsing_from_text.general_parse_from_string(
+                            text, tokenizer)
+            manual_tables.initialise_actions(minimised)
+            assert(parsing_from_text.general_parse_from_string(text, tokenizer)
+                   == expected)
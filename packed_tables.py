@@ -0,0 +1,314 @@
+'''Table driven parsing with the actions packed into integers.
+
+`manual_tables.advance` looks up a closure per action by state and symbol name,
+and a reduction calls back into the table for the goto step.  Here the
+actions are stored as integers in flat arrays indexed by state and symbol id:
+    action[state * num_terminals + terminal]
+    goto[state * num_nonterminals + nonterminal]
+Each action has an opcode (`ERROR`, `SHIFT`, `REDUCE` or `ACCEPT`) in its low
+bits and the state to shift to or production to reduce in the rest.  The goto
+step after a reduction is a lookup in its own table, so parsing a token is a
+single loop with no function calls.
+
+The trees produced are the same as `manual_tables` leaves in
+`State.accepted_expressions`.
+'''
+from array import array
+import itertools as itt
+import table_cache
+from manual_tables import DEFAULT_REDUCTION
+import logging
+logger = logging.getLogger(__name__)
+
+ERROR, SHIFT, REDUCE, ACCEPT = range(4)
+OPCODE_BITS = 2
+OPCODE_MASK = (1 << OPCODE_BITS) - 1
+
+def pack_action(opcode, argument=0):
+    return argument << OPCODE_BITS | opcode
+
+# An error given explicitly in the tables (e.g. from `%nonassoc`).  Drivers
+# treat it as any other error, but it is kept apart from empty cells so that
+# default reductions don't replace it.
+EXPLICIT_ERROR = pack_action(ERROR, 1)
+
+def encode_tables(descriptions, end_marker='$'):
+    '''Turn action tables described as in `table_cache.describe_tables` into
+    (terminals, nonterminals, productions, action rows, goto rows, default
+    reductions).
+    `productions` is a list of (nonterminal, length).
+    Nonterminals are the symbols reduced to, every other symbol in the tables
+    is a terminal.
+    A default reduction (see `manual_tables.use_default_reductions`) fills
+    every terminal of its row, and is also given in `default reductions`
+    (`ERROR` for rows without one).'''
+    productions = sorted(set((desc[2], desc[1]) for row in descriptions
+                             for desc in row.values() if desc[0] == 'red'))
+    nonterminals = sorted(set(name for name, _ in productions))
+    nonterminal_set = set(nonterminals)
+    terminals = sorted(set(sym for row in descriptions for sym in row
+                           if sym not in nonterminal_set
+                           and sym != DEFAULT_REDUCTION) | {end_marker})
+    terminal_ids = {name: i for i, name in enumerate(terminals)}
+    nonterminal_ids = {name: i for i, name in enumerate(nonterminals)}
+    production_ids = {prod: i for i, prod in enumerate(productions)}
+    action_rows = []
+    goto_rows = []
+    default_reductions = []
+    for row in descriptions:
+        actions = [pack_action(ERROR)] * len(terminals)
+        gotos = [-1] * len(nonterminals)
+        default = pack_action(ERROR)
+        for sym, desc in row.items():
+            if sym == DEFAULT_REDUCTION:
+                default = pack_action(REDUCE, production_ids[(desc[2], desc[1])])
+            elif sym in nonterminal_ids:
+                assert(desc[0] == 'shift')
+                gotos[nonterminal_ids[sym]] = desc[1]
+            elif desc[0] == 'shift':
+                actions[terminal_ids[sym]] = pack_action(SHIFT, desc[1])
+            elif desc[0] == 'red':
+                actions[terminal_ids[sym]] = pack_action(
+                        REDUCE, production_ids[(desc[2], desc[1])])
+            elif desc[0] == 'error':
+                actions[terminal_ids[sym]] = EXPLICIT_ERROR
+            else:
+                assert(desc[0] == 'accept')
+                actions[terminal_ids[sym]] = pack_action(ACCEPT)
+        if default != ERROR:
+            actions = [default if x == ERROR else x for x in actions]
+        action_rows.append(tuple(actions))
+        goto_rows.append(tuple(gotos))
+        default_reductions.append(default)
+    return (terminals, nonterminals, productions, action_rows, goto_rows,
+            default_reductions)
+
+class PackedTables:
+    def __init__(self, descriptions, end_marker='$'):
+        (terminals, nonterminals, productions, action_rows, goto_rows,
+         default_reductions) = encode_tables(descriptions, end_marker)
+        self.terminals = terminals
+        self.nonterminals = nonterminals
+        self.end_marker = end_marker
+        self.terminal_ids = {name: i for i, name in enumerate(terminals)}
+        nonterminal_ids = {name: i for i, name in enumerate(nonterminals)}
+        self.num_terminals = len(terminals)
+        self.num_nonterminals = len(nonterminals)
+        self.action = array('i', itt.chain.from_iterable(action_rows))
+        self.goto = array('i', itt.chain.from_iterable(goto_rows))
+        self.default_reduction = array('i', default_reductions)
+        self.production_lengths = array('i', (x for _, x in productions))
+        self.production_names = tuple(':' + name for name, _ in productions)
+        self.production_lhs = array('i', (nonterminal_ids[name]
+                                          for name, _ in productions))
+        # See `eliminate_unit_productions`.
+        self.unit_productions = bytearray(len(productions))
+    @classmethod
+    def from_action_tables(cls, action_tables, end_marker='$'):
+        '''Pack closure tables as made by `convert_to_action_table`.'''
+        return cls(table_cache.describe_tables(action_tables), end_marker)
+
+####### Unit productions
+# Chains of unit productions (e.g. `Add -> Factor -> Term`) make a reduction
+# each, popping and pushing the same stack entry and allocating a slice of the
+# forest plus a new node.  For a production A -> B the state below B is the
+# state below A as well, so the driver can instead go straight to the goto
+# state of A and leave the stacks as they are, either wrapping the value of B
+# in a node for A or (with elided nodes) using the value of B as the value of A.
+KEEP_NODE, ELIDE_NODE = 1, 2
+
+def unit_nonterminals(rules):
+    '''Nonterminals whose productions of length one all have a nonterminal on
+    the right hand side.  The tables only record the length of a production,
+    so a nonterminal with both A -> B and A -> x can't have its unit
+    productions told apart.'''
+    return set(key for key, gens in rules.items()
+               if any(len(gen) == 1 for gen in gens)
+               and all(gen[0] in rules for gen in gens if len(gen) == 1))
+
+def eliminate_unit_productions(tables, rules, keep_nodes=False):
+    '''Have `advance` collapse the unit productions of `rules` in `tables`.
+    With `keep_nodes` the trees are unchanged, otherwise the nodes of unit
+    productions are left out (see `elide_unit_nodes`).'''
+    units = unit_nonterminals(rules)
+    for prod, name in enumerate(tables.production_names):
+        if tables.production_lengths[prod] == 1 and name[1:] in units:
+            tables.unit_productions[prod] = KEEP_NODE if keep_nodes else ELIDE_NODE
+    return tables
+
+def elide_unit_nodes(tree, rules):
+    '''`tree` with the unit production nodes left out, as parsing with elided
+    nodes gives.'''
+    units = set(':' + x for x in unit_nonterminals(rules))
+    def elide(node):
+        if not isinstance(node, list):
+            return node
+        if len(node) == 2 and node[0] in units:
+            return elide(node[1])
+        return [node[0]] + [elide(x) for x in node[1:]]
+    return [elide(x) for x in tree]
+
+def count_nodes(tree):
+    '''Number of nodes (i.e. reductions made) in a parse tree.'''
+    if not isinstance(tree, list):
+        return 0
+    return (1 if tree and isinstance(tree[0], str) and tree[0].startswith(':')
+            else 0) + sum(count_nodes(x) for x in tree)
+
+class State:
+    '''Same layout as `manual_tables.State`.'''
+    def __init__(self):
+        self.accepted_expressions = []
+        self.stack = []
+        self.forest = []
+        self.top = 0
+
+def advance(tables, st, next_symbol, value):
+    '''Equivalent of `manual_tables.advance` using packed tables.
+    Raises KeyError on a syntax error, as `manual_tables.advance` does.
+    As in `manual_tables.reduce_defaults`, states with only a default
+    reduction are reduced as soon as they are reached.'''
+    term = tables.terminal_ids[next_symbol]
+    action = tables.action
+    default_reduction = tables.default_reduction
+    goto = tables.goto
+    width = tables.num_terminals
+    goto_width = tables.num_nonterminals
+    lengths = tables.production_lengths
+    names = tables.production_names
+    lhs = tables.production_lhs
+    unit = tables.unit_productions
+    stack = st.stack
+    forest = st.forest
+    top = st.top
+    shifted = False
+    while True:
+        packed = default_reduction[top]
+        if packed == ERROR:
+            if shifted:
+                st.top = top
+                return
+            packed = action[top * width + term]
+        opcode = packed & OPCODE_MASK
+        if opcode == SHIFT:
+            stack.append(top)
+            forest.append(value)
+            top = packed >> OPCODE_BITS
+            shifted = True
+        elif opcode == REDUCE:
+            prod = packed >> OPCODE_BITS
+            if unit[prod]:
+                if unit[prod] == KEEP_NODE:
+                    forest[-1] = [names[prod], forest[-1]]
+                top = goto[stack[-1] * goto_width + lhs[prod]]
+                continue
+            count = lengths[prod]
+            node = [names[prod]]
+            if count:
+                node.extend(forest[-count:])
+                del forest[-count:]
+                top = stack[-count]
+                del stack[-count:]
+            forest.append(node)
+            stack.append(top)
+            top = goto[top * goto_width + lhs[prod]]
+        elif opcode == ACCEPT:
+            st.top = stack.pop()
+            st.accepted_expressions.append(forest)
+            assert(len(st.accepted_expressions) == 1)
+            return
+        else:
+            st.top = top
+            raise KeyError('Unexpected {!r} ({!r}) in state {}'.format(
+                                next_symbol, value, top))
+
+def parse(tables, tokens):
+    '''Parse an iterable of (token type, text) pairs, without the end marker.'''
+    st = State()
+    for kind, value in tokens:
+        advance(tables, st, kind, value)
+    advance(tables, st, tables.end_marker, '')
+    assert(st.accepted_expressions)
+    return st.accepted_expressions.pop()
+
+def general_parse_from_string(inp, tables, abstract_tokenizer):
+    '''As `parsing_from_text.general_parse_from_string`.'''
+    st = State()
+    def do_advance(item, text, _, __):
+        advance(tables, st, item, text)
+    abstract_tokenizer.init(do_advance)
+    abstract_tokenizer.consume_text(inp)
+    abstract_tokenizer.eof()
+    assert(st.accepted_expressions)
+    return st.accepted_expressions.pop()
+
+if __name__ == '__main__':
+    import default_log_arg
+    import manual_tables
+    import parsing_from_text
+    import canonical_lr_generator
+    import parse_grammar
+    default_log_arg.do_default_logarg()
+    # The hand written tables.
+    tables = PackedTables.from_action_tables(manual_tables.default_action_table)
+    manual_tables.initialise_actions(None)
+    for text in ['hello +3*world10', '(x + 10)', 'x+13+8*y']:
+        assert(general_parse_from_string(
+                    text, tables, parsing_from_text.HardCodedTokenizer())
+               == parsing_from_text.parse_from_string(text))
+    try:
+        general_parse_from_string('(z + 9 + 10', tables,
+                                  parsing_from_text.HardCodedTokenizer())
+    except KeyError:
+        pass
+    else:
+        assert(not 'Should have failed with unexpected end of input')
+
+    # Generated tables, including empty productions (`Minus`).
+    for grammar, algorithm, inputs in [
+            ('tutorial-grammar.txt', 'canonical',
+             ['n * (4+5)*3 + -somename', '1', '-(a+b)*c']),
+            ('tutorial-grammar.txt', 'lalr', ['a * b + c']),
+            ('slr_lr_grammar.txt', 'lalr', ['b m ef', 'a n f e']),
+            ('precedence-grammar.txt', 'lalr', ['a + b * -c ^ d ^ 2 < e'])]:
+        action_tables = canonical_lr_generator.generate_action_tables(
+                            grammar, algorithm)
+        tables = PackedTables.from_action_tables(action_tables)
+        manual_tables.initialise_actions(action_tables)
+        tokenizer = canonical_lr_generator.get_tokenizer(grammar)
+        for text in inputs:
+            assert(general_parse_from_string(text, tables, tokenizer) ==
+                   parsing_from_text.general_parse_from_string(text, tokenizer))
+        if grammar == 'tutorial-grammar.txt':
+            # `Term -> Minus name .` and `Factor -> Term .` are reduced without
+            # waiting for the next token.
+            st = State()
+            advance(tables, st, 'name', 'x')
+            assert(st.forest == [[':Factor', [':Term', [':Minus'], 'x']]])
+        if grammar == 'precedence-grammar.txt':
+            # `%nonassoc` errors are kept as errors.
+            try:
+                general_parse_from_string('a < b < c', tables, tokenizer)
+            except KeyError:
+                pass
+            else:
+                assert(not 'Should have failed on %nonassoc')
+
+    # Unit productions, with and without their nodes in the tree.
+    with open('tutorial-grammar.txt') as infile:
+        rules = parse_grammar.get_rules(infile.read())
+    assert(unit_nonterminals(rules) == {'Start', 'Add', 'Factor'})
+    action_tables = canonical_lr_generator.generate_action_tables(
+                        'tutorial-grammar.txt')
+    tokenizer = canonical_lr_generator.get_tokenizer('tutorial-grammar.txt')
+    text = 'n * (4+5)*3 + -somename'
+    full = general_parse_from_string(
+            text, PackedTables.from_action_tables(action_tables), tokenizer)
+    tables = eliminate_unit_productions(
+            PackedTables.from_action_tables(action_tables), rules, True)
+    assert(general_parse_from_string(text, tables, tokenizer) == full)
+    tables = eliminate_unit_productions(
+            PackedTables.from_action_tables(action_tables), rules)
+    elided = general_parse_from_string(text, tables, tokenizer)
+    assert(elided == elide_unit_nodes(full, rules))
+    assert(count_nodes(full) - count_nodes(elided) == 6)
@@ -50,6 +50,32 @@ def get_rules_and_tokens(text):
 def get_rules(text):
     return get_rules_and_tokens(text)[0]
 
+# Precedence declarations, as in yacc:
+#   %left + -
+#   %left * /
+#   %right ^
+#   %nonassoc <
+# Each line is one level, later lines binding tighter.
+ASSOCIATIVITIES = ('left', 'right', 'nonassoc')
+
+def is_precedence(line):
+    return bool(re.match(r'^%({}) '.format('|'.join(ASSOCIATIVITIES)), line))
+
+def get_precedence(text):
+    '''Map of terminal to (level, associativity).'''
+    ret = {}
+    level = 0
+    for line in text.splitlines():
+        line = line.strip()
+        if not is_precedence(line):
+            continue
+        level += 1
+        assoc, *terminals = split_strip(line)
+        for t in terminals:
+            assert(t not in ret)
+            ret[t] = (level, assoc[1:])
+    return ret
+
 if __name__ == '__main__':
     import sys
     import pprint
@@ -73,3 +99,6 @@ if __name__ == '__main__':
         assert(dict(rules) == {'Start': [['hello', 'world']], 'world': [['n'], ['y']]})
         assert(named_tokens == {'hello': ('abc', 'xyz')})
         assert(unnamed_tokens == {'n', 'y'})
+        assert(get_precedence('%left + -\n%right ^\nE = E + E\n%nonassoc <')
+               == {'+': (1, 'left'), '-': (1, 'left'), '^': (2, 'right'),
+                   '<': (3, 'nonassoc')})
@@ -0,0 +1,182 @@
+'''Write a standalone Python parser module for a grammar.
+
+The generators build their action tables as closures at run time (see
+`convert_to_action_table`), so every process using them has to run the
+generator first.  This writes the tables out as literals in an importable
+module instead, in the spirit of `manual_tables.default_action_table`, along
+with a small driver loop.  The generated module does not import anything from
+this repository.
+
+Tables in the generated module:
+    TERMINALS, NONTERMINALS:  Symbol names, index is the symbol id.
+    PRODUCTION_LENGTHS, PRODUCTION_NAMES, PRODUCTION_LHS:
+                              Number of symbols on the right hand side, name
+                              used in the parse tree (':' + nonterminal), and
+                              nonterminal id of each production.
+    ACTION[state][terminal]:  Packed action, opcode in the low two bits and
+                              argument in the rest (see `packed_tables`).
+    GOTO[state][nonterminal]: State to go to after reducing to that
+                              nonterminal, or -1.
+'''
+import pprint
+import generator_take2
+import canonical_lr_generator
+import table_cache
+from packed_tables import (ERROR, SHIFT, REDUCE, ACCEPT, OPCODE_BITS,
+                           OPCODE_MASK, encode_tables)
+import logging
+logger = logging.getLogger(__name__)
+
+DRIVER = '''
+TERMINAL_IDS = {name: i for i, name in enumerate(TERMINALS)}
+
+def parse(tokens):
+    \'\'\'Parse an iterable of (token type, text) pairs, without the end marker.
+    Returns the list holding the parse tree, as the generators' tables leave
+    in `manual_tables.State.accepted_expressions`.\'\'\'
+    action = ACTION
+    goto = GOTO
+    lengths = PRODUCTION_LENGTHS
+    names = PRODUCTION_NAMES
+    lhs = PRODUCTION_LHS
+    terminal_ids = TERMINAL_IDS
+    states = [0]
+    forest = []
+    for kind, value in itertools.chain(tokens, ((END_MARKER, ''),)):
+        term = terminal_ids.get(kind)
+        if term is None:
+            raise SyntaxError('Unknown token type {!r}'.format(kind))
+        while True:
+            packed = action[states[-1]][term]
+            opcode = packed & OPCODE_MASK
+            if opcode == SHIFT:
+                states.append(packed >> OPCODE_BITS)
+                forest.append(value)
+                break
+            elif opcode == REDUCE:
+                prod = packed >> OPCODE_BITS
+                count = lengths[prod]
+                node = [names[prod]]
+                if count:
+                    node.extend(forest[-count:])
+                    del forest[-count:]
+                    del states[-count:]
+                forest.append(node)
+                states.append(goto[states[-1]][lhs[prod]])
+            elif opcode == ACCEPT:
+                return forest
+            else:
+                raise SyntaxError('Unexpected {!r} ({!r}) in state {}'.format(
+                                    kind, value, states[-1]))
+    raise SyntaxError('Input ended without accepting')
+'''
+
+def format_rows(name, rows):
+    lines = ['{} = ('.format(name)]
+    lines.extend('    {!r},  # {}'.format(row, num) for num, row in enumerate(rows))
+    lines.append(')')
+    return '\n'.join(lines)
+
+def module_source(descriptions, description, end_marker='$'):
+    '''Source of a parser module for the described tables.  `description`
+    goes in the module docstring to say where the tables came from.'''
+    terminals, nonterminals, productions, action_rows, goto_rows, _ = (
+            encode_tables(descriptions, end_marker))
+    nonterminal_ids = {name: i for i, name in enumerate(nonterminals)}
+    chunks = [
+        "'''LR parser tables for {}.\n\n"
+        "Generated by parser_module.py, do not edit.\n'''".format(description),
+        'import itertools',
+        'ERROR, SHIFT, REDUCE, ACCEPT = {!r}'.format((ERROR, SHIFT, REDUCE, ACCEPT)),
+        'OPCODE_BITS = {!r}'.format(OPCODE_BITS),
+        'OPCODE_MASK = {!r}'.format(OPCODE_MASK),
+        'END_MARKER = {!r}'.format(end_marker),
+        'TERMINALS = ' + pprint.pformat(tuple(terminals), compact=True),
+        'NONTERMINALS = ' + pprint.pformat(tuple(nonterminals), compact=True),
+        'PRODUCTION_LENGTHS = ' + pprint.pformat(
+            tuple(length for _, length in productions), compact=True),
+        'PRODUCTION_NAMES = ' + pprint.pformat(
+            tuple(':' + name for name, _ in productions), compact=True),
+        'PRODUCTION_LHS = ' + pprint.pformat(
+            tuple(nonterminal_ids[name] for name, _ in productions),
+            compact=True),
+        format_rows('ACTION', action_rows),
+        format_rows('GOTO', goto_rows),
+    ]
+    return '\n'.join(chunks) + '\n' + DRIVER
+
+ALGORITHMS = ('slr',) + canonical_lr_generator.ALGORITHMS + ('auto',)
+
+def generate_action_tables(grammar_filename, algorithm):
+    if algorithm == 'slr':
+        return generator_take2.generate_action_tables(grammar_filename)
+    return canonical_lr_generator.generate_action_tables(grammar_filename,
+                                                         algorithm)
+
+def write_parser_module(grammar_filename, output_filename,
+                        algorithm='canonical'):
+    descriptions = table_cache.describe_tables(
+            generate_action_tables(grammar_filename, algorithm))
+    source = module_source(descriptions, '{} ({})'.format(grammar_filename,
+                                                         algorithm))
+    with open(output_filename, 'w') as outfile:
+        outfile.write(source)
+
+def tokens_from_string(text, tokenizer):
+    '''(token type, text) pairs from one of the `parsing_from_text`
+    tokenizers, without the end marker, to pass to a generated `parse`.'''
+    tokens = []
+    def collect(kind, value, _, __):
+        if kind != '$':
+            tokens.append((kind, value))
+    tokenizer.init(collect)
+    tokenizer.consume_text(text)
+    tokenizer.eof()
+    return tokens
+
+if __name__ == '__main__':
+    import argparse
+    import importlib.util
+    import os
+    import sys
+    import tempfile
+    import default_log_arg
+    import manual_tables
+    import parsing_from_text
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--grammar', default='tutorial-grammar.txt')
+    parser.add_argument('--algorithm', default='canonical', choices=ALGORITHMS)
+    parser.add_argument('--output', help='Where to write the parser module')
+    args = default_log_arg.add_default_logarg(parser)
+    if args.output:
+        write_parser_module(args.grammar, args.output, args.algorithm)
+        sys.exit(0)
+    def load_module(filename):
+        spec = importlib.util.spec_from_file_location('generated_parser',
+                                                      filename)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    with tempfile.TemporaryDirectory() as directory:
+        for grammar, algorithm, inputs in [
+                ('tutorial-grammar.txt', 'canonical',
+                 ['n * (4+5)*3 + -somename', '1', '-(a+b)*c']),
+                ('tutorial-grammar.txt', 'slr', ['a * b + c']),
+                ('slr_lr_grammar.txt', 'lalr', ['b m ef', 'a n f e'])]:
+            filename = os.path.join(directory, 'parser.py')
+            write_parser_module(grammar, filename, algorithm)
+            generated = load_module(filename)
+            tokenizer = canonical_lr_generator.get_tokenizer(grammar)
+            canonical_lr_generator.initialise_actions(grammar, 'canonical')
+            for text in inputs:
+                expected = parsing_from_text.general_parse_from_string(
+                                text, tokenizer)
+                tokens = tokens_from_string(text, tokenizer)
+                assert(generated.parse(tokens) == expected)
+        # Syntax errors are reported rather than silently accepted.
+        try:
+            generated.parse([('a', 'a'), ('a', 'a')])
+        except SyntaxError:
+            pass
+        else:
+            assert(not 'Should have failed to parse')
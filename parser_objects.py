@@ -0,0 +1,390 @@
+'''Grammar, tables and parser objects for using several grammars at once.
+
+The module level parsing functions work with one grammar at a time:
+`manual_tables.advance` parses with the tables last given to
+`manual_tables.initialise_actions`.  Here each `Grammar` holds its own text
+and tokens, each `ParserTables` its own action tables, and each `Parser` its
+own tokenizer and parse state, so a process can serve many grammars without
+reinitialising anything per request:
+
+    tables = Grammar.from_file('tutorial-grammar.txt').tables()
+    tree = tables.parser().parse('a * (b + 1)')
+
+Parsing takes no locks (bar building a row of lazy tables); any number of
+threads can parse with the same tables as long as each uses its own `Parser`.
+The generators are given the grammar they work on rather than keeping it in
+globals, so tables can be generated from any thread, though being pure Python
+threads take turns at it.  `generate_all` builds the tables for many grammars
+in parallel in separate processes instead.
+
+Input arriving a piece at a time can be pushed to a parser as it comes:
+
+    parser = tables.parser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    tree, = parser.close()
+
+and a stream of top-level parses one after another can be parsed with
+`tables.parser(sequence=True)`, which gives back each parse as soon as it is
+complete rather than holding on to them all.
+'''
+import concurrent.futures
+import canonical_lr_generator
+import manual_tables
+import minimise_tables
+import parse_grammar
+import parsing_from_text
+import table_cache
+import logging
+logger = logging.getLogger(__name__)
+
+ALGORITHMS = ('auto', 'slr') + canonical_lr_generator.ALGORITHMS
+
+class Grammar:
+    def __init__(self, text, name='<grammar>'):
+        self.text = text
+        self.name = name
+        _, self.named_tokens, self.unnamed_tokens = (
+                parse_grammar.get_rules_and_tokens(text))
+
+    @classmethod
+    def from_file(cls, filename):
+        with open(filename) as infile:
+            return cls(infile.read(), filename)
+
+    def tokenizer(self):
+        '''A new tokenizer for this grammar (tokenizers hold the state of the
+        text they are part way through).'''
+        return parsing_from_text.ScanningTokenizer(self.named_tokens,
+                                                   self.unnamed_tokens)
+
+    def describe_tables(self, algorithm='auto', minimise=False):
+        '''Descriptions of the action tables (see `table_cache`) and the
+        algorithm that made them.'''
+        assert(algorithm in ALGORITHMS)
+        analysis = canonical_lr_generator.analyse_grammar(self.text)
+        if algorithm == 'auto':
+            action_table, algorithm, _ = canonical_lr_generator.escalate(
+                    analysis, name=self.name)
+        else:
+            action_table = canonical_lr_generator.convert_to_action_table(
+                    canonical_lr_generator.states_for(analysis, algorithm),
+                    'Start')
+        descriptions = table_cache.describe_tables(action_table)
+        if minimise:
+            descriptions = minimise_tables.minimise_descriptions(descriptions)
+        return descriptions, algorithm
+
+    def tables(self, algorithm='auto', minimise=False, lazy=False):
+        '''With `lazy`, canonical LR(1) tables whose states are built as
+        parsers reach them (see `canonical_lr_generator.LazyActionTable`).
+        Only canonical tables are built lazily, so `lazy` with 'auto' means
+        'canonical'.'''
+        if lazy:
+            if algorithm not in ('auto', 'canonical') or minimise:
+                raise ValueError('Lazy tables are canonical and unminimised, '
+                                 'not {}{}'.format(
+                                    algorithm, ' minimised' if minimise else ''))
+            action_table = canonical_lr_generator.LazyActionTable(
+                    canonical_lr_generator.analyse_grammar(self.text))
+            return ParserTables(self, action_table, 'canonical')
+        descriptions, algorithm = self.describe_tables(algorithm, minimise)
+        return ParserTables(self, table_cache.build_tables(descriptions),
+                            algorithm)
+
+class ParserTables:
+    '''Action tables for a grammar, shared between parsers.  Tables are fixed
+    once built, except lazy ones, which add rows as parsers reach them (under
+    a lock of their own, see `canonical_lr_generator.LazyActionTable`).'''
+    def __init__(self, grammar, action_table, algorithm):
+        self.grammar = grammar
+        self.action_table = action_table
+        self.algorithm = algorithm
+
+    def parser(self, sequence=False):
+        return Parser(self, sequence)
+
+class Parser:
+    '''Parses text with some `ParserTables`.  Holds the state of the current
+    parse, so use one per thread.
+
+    Text can be given all at once to `parse`, or pushed a chunk at a time to
+    `feed` and finished with `close`.  Tokens and positions carry on across
+    chunks, wherever they are split.  With `sequence`, the text is any number
+    of top-level parses one after another, each running for as long as the
+    next token can carry it on.  `feed` and `close` return the parses they
+    completed, and nothing more is kept of them, so an unending stream is
+    parsed in the memory one of its parses takes, plus the text of a token
+    split between chunks (see `general_tokenizer.Scanner`).
+
+    `feeding` and `closing` do the same as `feed` and `close` a step at a
+    time, for spreading the work of a chunk out (see `async_parsing`).'''
+    def __init__(self, tables, sequence=False):
+        self.tables = tables
+        self.sequence = sequence
+        # Made once and reset for each input, since making the scanner means
+        # compiling its regular expression.
+        self.tokenizer = tables.grammar.tokenizer()
+        self.tokenizer.init(self.advance)
+        self.state = None
+        # Tokens waiting to be advanced over by `feeding` or `closing`.
+        self.queued = None
+
+    def parse(self, text):
+        # Not part way through feeding.
+        assert(self.state is None)
+        self.start()
+        try:
+            self.tokenizer.consume_text(text)
+            self.tokenizer.eof()
+        finally:
+            self.state = None
+        tree, = self.take_completed()
+        return tree
+
+    def feed(self, chunk):
+        if self.state is None:
+            self.start()
+        self.tokenizer.consume_text(chunk)
+        return self.take_completed()
+
+    def close(self):
+        '''End the input, returning the parses it completed.  The parser
+        can then be fed the next input.'''
+        if self.state is None:
+            self.start()
+        self.tokenizer.eof()
+        self.state = None
+        return self.take_completed()
+
+    def feeding(self, chunk):
+        '''As `feed`, a generator yielding after each action of the parser
+        (see `manual_tables.advancing`).  The parses completed are left for
+        `take_completed`.'''
+        if self.state is None:
+            self.start()
+        yield from self.stepping(self.tokenizer.consume_text, chunk)
+
+    def closing(self):
+        '''As `close`, a step at a time (see `feeding`).'''
+        if self.state is None:
+            self.start()
+        yield from self.stepping(self.tokenizer.eof)
+        self.state = None
+
+    def stepping(self, scan, *args):
+        # The scanner is quick, so the tokens from `scan` are all found first
+        # and then advanced over a step at a time.
+        self.queued = []
+        try:
+            scan(*args)
+        finally:
+            tokens, self.queued = self.queued, None
+        for symbol, value in tokens:
+            yield from self.advancing(symbol, value)
+
+    def start(self):
+        self.state = manual_tables.State(self.tables.action_table)
+        self.started = False
+        self.completed = []
+        self.tokenizer.reset()
+
+    def take_completed(self):
+        completed, self.completed = self.completed, []
+        return completed
+
+    def advance(self, symbol, value, _, __):
+        if self.queued is not None:
+            self.queued.append((symbol, value))
+        else:
+            manual_tables.run_steps(self.advancing(symbol, value))
+
+    def advancing(self, symbol, value):
+        if symbol == '$':
+            # Nothing after the last parse of a sequence.
+            if self.started or not self.sequence:
+                yield from self.finishing()
+            return
+        if (self.sequence and self.started
+                and not (yield from manual_tables.shifting(self.state,
+                                                           symbol))):
+            # Can't carry on, so this symbol starts the next parse.  If the
+            # current one can't end here either, finishing it fails.
+            yield from self.finishing()
+        yield from manual_tables.advancing(self.state, symbol, value)
+        self.started = True
+
+    def finishing(self):
+        yield from manual_tables.advancing(self.state, '$', '')
+        assert(self.state.accepted_expressions)
+        self.completed.append(self.state.accepted_expressions.pop())
+        self.state = manual_tables.State(self.tables.action_table)
+        self.started = False
+
+def _describe_tables(text, name, algorithm, minimise):
+    # Closures can't be sent between processes, their descriptions can.
+    return Grammar(text, name).describe_tables(algorithm, minimise)
+
+def generate_all(grammars, algorithm='auto', minimise=False, max_workers=None):
+    '''`ParserTables` for each of `grammars`, generated in parallel in a pool
+    of processes (threads would take turns at the pure Python generators).'''
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        futures = [executor.submit(_describe_tables, g.text, g.name, algorithm,
+                                   minimise)
+                   for g in grammars]
+        results = [f.result() for f in futures]
+    return [ParserTables(g, table_cache.build_tables(descriptions), used)
+            for g, (descriptions, used) in zip(grammars, results)]
+
+if __name__ == '__main__':
+    import default_log_arg
+    import manual_tables
+    default_log_arg.do_default_logarg()
+    inputs = {'tutorial-grammar.txt': ['n * (4+5)*3 + -somename', '1',
+                                       '-(a+b)*c'],
+              'slr_lr_grammar.txt': ['b m ef', 'a n f e'],
+              'lr_not_lalr_grammar.txt': ['a e c', 'b e d'],
+              'precedence-grammar.txt': ['a + b * c ^ d ^ e', 'a < -b']}
+    grammars = [Grammar.from_file(filename) for filename in inputs]
+    tables = [g.tables() for g in grammars]
+    assert([t.algorithm for t in tables] == ['slr', 'lalr', 'canonical', 'slr'])
+
+    # Expected trees from the module level functions.
+    expected = {}
+    for grammar in grammars:
+        canonical_lr_generator.initialise_actions(grammar.name)
+        tokenizer = canonical_lr_generator.get_tokenizer(grammar.name)
+        for text in inputs[grammar.name]:
+            expected[grammar.name, text] = (
+                    parsing_from_text.general_parse_from_string(text,
+                                                                tokenizer))
+    # The global tables are not used by parsers with their own.
+    manual_tables.initialise_actions(None)
+
+    # Every grammar parsed from several threads at once, including with tables
+    # built as they go.
+    tables.extend(g.tables(lazy=True) for g in grammars)
+    assert(all(t.algorithm == 'canonical' for t in tables[-len(grammars):]))
+    for algorithm, minimise in [('lalr', False), ('canonical', True)]:
+        try:
+            grammars[0].tables(algorithm, minimise, lazy=True)
+        except ValueError:
+            pass
+        else:
+            assert(not 'Lazy tables should only be canonical')
+    def parse_all(table):
+        parser = table.parser()
+        return [(table.grammar.name, text, parser.parse(text))
+                for _ in range(20) for text in inputs[table.grammar.name]]
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(parse_all, tables * 4))
+    for result in results:
+        for name, text, tree in result:
+            assert(tree == expected[name, text])
+
+    # A parser keeps the one tokenizer, starting it again for each text, and
+    # a syntax error doesn't stop it parsing the next.
+    parser = tables[0].parser()
+    scanner = parser.tokenizer.tok
+    try:
+        parser.parse('a + )')
+    except KeyError:
+        pass
+    else:
+        assert(not 'Should have failed')
+    for text in inputs['tutorial-grammar.txt']:
+        assert(parser.parse(text) == expected['tutorial-grammar.txt', text])
+    assert(parser.tokenizer.tok is scanner)
+
+    # Lazy tables build their rows under a lock of their own, so neither
+    # another lazy table nor a generation waits for them.
+    lazy = grammars[0].tables(lazy=True)
+    with lazy.action_table.lock:
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            other = executor.submit(lambda: grammars[2].tables(lazy=True)
+                                    .parser().parse('a e c'))
+            generated = executor.submit(grammars[1].tables, 'canonical')
+            assert(other.result(timeout=60)
+                   == expected['lr_not_lalr_grammar.txt', 'a e c'])
+            assert(generated.result(timeout=60).algorithm == 'canonical')
+
+    # Tables generated from several threads, and in other processes, are the
+    # same as those generated one at a time, alongside the module level
+    # functions and lazy tables building rows.
+    def module_level(g):
+        tables = canonical_lr_generator.generate_action_tables(g.name, 'auto')
+        lazy = g.tables(lazy=True)
+        assert(all(lazy.parser().parse(text) == expected[g.name, text]
+                   for text in inputs[g.name]))
+        return tables
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        others = [executor.submit(module_level, g) for g in grammars * 2]
+        threaded = list(executor.map(lambda g: g.tables('canonical'),
+                                     grammars * 2))
+        for g, future in zip(grammars * 2, others):
+            assert(table_cache.describe_tables(future.result())
+                   == table_cache.describe_tables(g.tables().action_table))
+    in_processes = generate_all(grammars, 'canonical')
+    for g, a, b, c in zip(grammars, threaded, threaded[len(grammars):],
+                          in_processes):
+        sequential = table_cache.describe_tables(
+                        canonical_lr_generator.generate_action_tables(g.name))
+        for t in (a, b, c):
+            assert(table_cache.describe_tables(t.action_table) == sequential)
+    assert([t.algorithm for t in generate_all(grammars)]
+           == ['slr', 'lalr', 'canonical', 'slr'])
+
+    # Text fed in chunks parses the same wherever it is split, and as a
+    # sequence each parse comes back as soon as the next token shows it has
+    # ended (and a token at the end of a chunk is only seen once we know
+    # where it ends).
+    tutorial = tables[0]
+    for text in inputs['tutorial-grammar.txt']:
+        for split in range(len(text) + 1):
+            parser = tutorial.parser()
+            assert(parser.feed(text[:split]) == [])
+            assert(parser.feed(text[split:]) == [])
+            assert(parser.close() == [expected['tutorial-grammar.txt', text]])
+    texts = inputs['tutorial-grammar.txt']
+    stream = '\n'.join(texts)
+    parser = tutorial.parser(sequence=True)
+    for ch in stream:
+        parser.feed(ch)
+    assert(parser.close() == [expected['tutorial-grammar.txt', texts[-1]]])
+    parser = tutorial.parser(sequence=True)
+    assert(parser.feed(texts[0] + ' ' + texts[1]) == [])
+    assert(parser.feed('\n') == [expected['tutorial-grammar.txt', texts[0]]])
+    assert(parser.feed(texts[2]) == [expected['tutorial-grammar.txt', texts[1]]])
+    assert(parser.close() == [expected['tutorial-grammar.txt', texts[2]]])
+    assert(parser.close() == [])
+    for split in range(len(stream) + 1):
+        parser = tutorial.parser(sequence=True)
+        assert(parser.feed(stream[:split]) + parser.feed(stream[split:])
+               + parser.close()
+               == [expected['tutorial-grammar.txt', text] for text in texts])
+    # The parse stack doesn't grow as the stream goes on.
+    parser = tutorial.parser(sequence=True)
+    depths = []
+    for _ in range(200):
+        assert(len(parser.feed(texts[0] + ' ')) <= 1)
+        depths.append(len(parser.state.stack))
+    assert(len(parser.close()) == 1 and len(set(depths)) == 1)
+    # Nor does the text held between chunks: whitespace isn't kept at all,
+    # and a token split over many chunks only keeps its own text.
+    parser = tutorial.parser(sequence=True)
+    name = 'n' * 3000
+    pending = []
+    for chunk in ['  \n'] * 3000 + list(name):
+        assert(parser.feed(chunk) == [])
+        pending.append(len(parser.tokenizer.tok.pending))
+    assert(max(pending[:3000]) == 0 and max(pending) == len(name))
+    assert(parser.close() == [tutorial.parser().parse(name)])
+    # A token that can neither carry on nor start a parse is still an error.
+    parser = tutorial.parser(sequence=True)
+    try:
+        parser.feed('a + )')
+        parser.close()
+    except KeyError:
+        pass
+    else:
+        assert(not 'Should have failed')
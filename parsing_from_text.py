@@ -2,18 +2,20 @@
 import tokenizer
 import general_tokenizer
 import manual_tables
+import mmap
+import os
 import sys
 import logging
 logger = logging.getLogger(__name__)
 
-def general_parse_from_string(inp, abstract_tokenizer):
-    st = manual_tables.State()
+def general_parse_from_string(inp, abstract_tokenizer, action_table=None):
+    st = manual_tables.State(action_table)
     def do_advance(item, text, _, __):
-        logger.debug('Calling advance with {}: {}'.format(item, text))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Calling advance with {}: {}'.format(item, text))
         manual_tables.advance(st, item, text)
     abstract_tokenizer.init(do_advance)
-    for ch in inp:
-        abstract_tokenizer.consume(ch)
+    abstract_tokenizer.consume_text(inp)
     abstract_tokenizer.eof()
     assert(st.accepted_expressions)
     return st.accepted_expressions.pop()
@@ -25,6 +27,9 @@ class HardCodedTokenizer:
         self.tok = tokenizer.Tokenizer(advance)
     def consume(self, ch):
         tokenizer.tokenize(self.tok, ch)
+    def consume_text(self, text):
+        for ch in text:
+            self.consume(ch)
     def eof(self):
         tokenizer.tokenize(self.tok, '')
 
@@ -44,9 +49,62 @@ class ParametrisedTokenizer:
                     lambda x, y: advance('$', '', x, y))
     def consume(self, ch):
         self.tok.consume_char(ch)
+    def consume_text(self, text):
+        for ch in text:
+            self.tok.consume_char(ch)
     def eof(self):
         self.tok.eof()
 
+class ScanningTokenizer(ParametrisedTokenizer):
+    '''As `ParametrisedTokenizer`, matching whole tokens of the text given to
+    `consume_text` with a regular expression (see `general_tokenizer.Scanner`)
+    rather than going through it a character at a time.'''
+    def init(self, advance):
+        tokenizer_states = general_tokenizer.states_from_grammar(
+                        self.named_tokens, self.unnamed_tokens,
+                        advance, self.ignorewhitespace)
+        self.tok = general_tokenizer.Scanner(
+                    tokenizer_states,
+                    lambda x, y: advance('$', '', x, y))
+    def reset(self):
+        '''Start on new text with the scanner made by `init`, rather than
+        making another (and compiling its regular expression again).'''
+        self.tok.reset()
+    def consume_text(self, text):
+        self.tok.consume_text(text)
+
+class SpanTokenizer(ScanningTokenizer):
+    '''As `ScanningTokenizer`, for a whole bytes-like buffer (`bytes`,
+    `memoryview`, `mmap`), giving the parser each token as a
+    `general_tokenizer.Span` of it rather than a copy of its text.'''
+    def init(self, advance):
+        tokenizer_states = general_tokenizer.states_from_grammar(
+                        self.named_tokens, self.unnamed_tokens,
+                        advance, self.ignorewhitespace)
+        self.tok = general_tokenizer.SpanScanner(
+                    tokenizer_states,
+                    lambda x, y: advance('$', '', x, y))
+
+def parse_file(filename, abstract_tokenizer, action_table=None):
+    '''Parse a file mapped into memory rather than read, so that with a
+    `SpanTokenizer` the memory used goes with the size of the tree rather than
+    of the file.  The tree's spans keep the mapping open.'''
+    with open(filename, 'rb') as infile:
+        # Empty files can't be mapped.
+        if os.fstat(infile.fileno()).st_size:
+            buffer = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            buffer = b''
+    return general_parse_from_string(buffer, abstract_tokenizer, action_table)
+
+def materialise(tree):
+    '''`tree` with the text of each span in place of the span.'''
+    if isinstance(tree, list):
+        return [materialise(x) for x in tree]
+    if isinstance(tree, general_tokenizer.Span):
+        return tree.text()
+    return tree
+
 def parse_from_string(inp):
     return general_parse_from_string(inp, HardCodedTokenizer())
 
@@ -66,3 +124,18 @@ if __name__ == '__main__':
                   [':Add', [':Factor', [':Term', 'hello']]],
                   '+',
                   [':Factor', [':Factor', [':Term', '3']], '*', [':Term', 'world10']]]])
+
+        # Parsing a file as spans of its mapping gives the same tree.
+        import string
+        import tempfile
+        named_tokens = {'name': (string.ascii_letters,
+                                 string.ascii_letters + string.digits),
+                        'int': (string.digits, string.digits)}
+        unnamed_tokens = '+*()'
+        with tempfile.NamedTemporaryFile('w', suffix='.txt') as outfile:
+            outfile.write('hello +3*\n  world10\n')
+            outfile.flush()
+            tree = parse_file(outfile.name, SpanTokenizer(named_tokens,
+                                                          unnamed_tokens))
+        assert(isinstance(tree[0][3][3][1], general_tokenizer.Span))
+        assert(materialise(tree) == parsed_expression)
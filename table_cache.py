@@ -0,0 +1,198 @@
+'''On-disk cache of generated action tables.
+
+Generating the tables for a grammar takes much longer than loading them, and
+the tables only change when the grammar or the generator changes.  Entries are
+keyed on a hash of:
+    - The grammar text.
+    - The source of the generator module and of every module it uses to make
+      the tables (standing in for a version number, see GENERATOR_SOURCES).
+    - The arguments passed to the generator (e.g. the algorithm).
+so editing any of those gives a new entry rather than stale tables.
+
+The action tables themselves are lists of {symbol: closure}, which can't be
+serialised.  `manual_tables` records what each closure does on its `action`
+attribute, so we store those descriptions and rebuild the closures on load.
+'''
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+import manual_tables
+import logging
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of the stored tables changes.
+FORMAT_VERSION = 1
+
+ACTIONS = {
+    'shift': manual_tables.shift,
+    'red': manual_tables.red,
+    'accept': manual_tables.accept,
+    'error': manual_tables.error,
+}
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'lr-parser-tables')
+
+# Modules whose source decides what tables the generators make, hashed along
+# with the generator's own.  Add any module the generators come to depend on.
+GENERATOR_SOURCES = ('canonical_lr_generator.py', 'generator_take2.py',
+                     'lalr_generator.py', 'grammar_analysis.py',
+                     'parse_grammar.py', 'manual_tables.py',
+                     'minimise_tables.py', 'table_cache.py')
+
+def generator_sources(directory=os.path.dirname(os.path.abspath(__file__))):
+    return [os.path.join(directory, x) for x in GENERATOR_SOURCES]
+
+def cache_key(grammar_text, generator_file, args, sources=None):
+    digest = hashlib.sha256()
+    digest.update(repr((FORMAT_VERSION, args)).encode())
+    if sources is None:
+        sources = generator_sources()
+    # Each file once, in the same order wherever the generator is.
+    files = sorted(set(os.path.abspath(x) for x in [generator_file, *sources]),
+                   key=os.path.basename)
+    for filename in files:
+        with open(filename, 'rb') as infile:
+            digest.update(hashlib.sha256(infile.read()).digest())
+    digest.update(grammar_text.encode())
+    return digest.hexdigest()
+
+def describe_tables(action_tables):
+    # Equal symbols and descriptions are shared, so the pickled tables only
+    # depend on what is in them and not on where the strings came from
+    # (pickle writes each distinct object once).
+    shared = {}
+    def canonical(x):
+        if isinstance(x, tuple):
+            x = tuple(canonical(y) for y in x)
+        return shared.setdefault(x, x)
+    return [{canonical(sym): canonical(action.action)
+             for sym, action in row.items()}
+            for row in action_tables]
+
+def build_tables(descriptions):
+    # Each distinct action only needs one closure.
+    made = {}
+    def action(desc):
+        if desc not in made:
+            made[desc] = ACTIONS[desc[0]](*desc[1:])
+        return made[desc]
+    return [{sym: action(desc) for sym, desc in row.items()}
+            for row in descriptions]
+
+def load(filename):
+    '''Tables stored in `filename`, or None if missing or unreadable.'''
+    try:
+        with open(filename, 'rb') as infile:
+            return build_tables(pickle.load(infile))
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError,
+            TypeError, ValueError) as e:
+        if not isinstance(e, FileNotFoundError):
+            logger.warning('Ignoring bad table cache {}: {}'.format(filename, e))
+        return None
+
+def store(filename, action_tables):
+    # Write to a temporary file and rename so that a concurrent reader never
+    # sees half an entry.
+    directory = os.path.dirname(filename)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as outfile:
+            pickle.dump(describe_tables(action_tables), outfile,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.remove(tmpname)
+        raise
+
+def cached_action_tables(grammar_filename, generator_file, generate, *args,
+                         cache_dir=None):
+    '''Action tables for `grammar_filename`, as `generate(grammar_filename,
+    *args)` would give.  `generator_file` is the source of the module
+    `generate` comes from, used to invalidate entries when it changes.'''
+    with open(grammar_filename) as infile:
+        text = infile.read()
+    key = cache_key(text, generator_file, args)
+    filename = os.path.join(cache_dir or default_cache_dir(), key + '.pickle')
+    start = time.perf_counter()
+    action_tables = load(filename)
+    if action_tables is not None:
+        logger.info('Loaded tables from {} in {:.4f}s'.format(
+                        filename, time.perf_counter() - start))
+        return action_tables
+    action_tables = generate(grammar_filename, *args)
+    store(filename, action_tables)
+    logger.info('Generated and stored tables in {} in {:.4f}s'.format(
+                    filename, time.perf_counter() - start))
+    return action_tables
+
+if __name__ == '__main__':
+    import shutil
+    import default_log_arg
+    import canonical_lr_generator
+    import parsing_from_text
+    default_log_arg.do_default_logarg()
+    cache_dir = tempfile.mkdtemp()
+    try:
+        calls = []
+        def generate(grammar_filename, *args):
+            calls.append(args)
+            return canonical_lr_generator.generate_action_tables(
+                    grammar_filename, *args)
+        def cached(grammar_filename, *args):
+            return cached_action_tables(grammar_filename,
+                                        canonical_lr_generator.__file__,
+                                        generate, *args, cache_dir=cache_dir)
+        # Only the first call for each algorithm generates the tables.
+        first_tables = cached('tutorial-grammar.txt')
+        loaded_tables = cached('tutorial-grammar.txt')
+        cached('tutorial-grammar.txt', 'lalr')
+        assert(calls == [(), ('lalr',)])
+        assert(describe_tables(first_tables) == describe_tables(loaded_tables))
+
+        # Loaded tables parse the same as freshly generated ones.
+        tokenizer = canonical_lr_generator.get_tokenizer('tutorial-grammar.txt')
+        test_input = 'n * (4+5)*3 + -somename'
+        manual_tables.initialise_actions(first_tables)
+        expected = parsing_from_text.general_parse_from_string(test_input,
+                                                               tokenizer)
+        manual_tables.initialise_actions(loaded_tables)
+        assert(parsing_from_text.general_parse_from_string(test_input, tokenizer)
+               == expected)
+
+        # Changing the grammar gives a new entry.
+        grammar_copy = os.path.join(cache_dir, 'grammar.txt')
+        with open('tutorial-grammar.txt') as infile:
+            text = infile.read()
+        with open(grammar_copy, 'w') as outfile:
+            outfile.write(text + 'Term = [ Add ]\n')
+        cached(grammar_copy)
+        assert(calls == [(), ('lalr',), ()])
+
+        # Changing a module the generator depends on gives a new key.
+        sources_dir = os.path.join(cache_dir, 'sources')
+        os.makedirs(sources_dir)
+        for filename in generator_sources():
+            shutil.copy(filename, sources_dir)
+        copies = generator_sources(sources_dir)
+        generator_copy = os.path.join(sources_dir, 'canonical_lr_generator.py')
+        key = cache_key(text, canonical_lr_generator.__file__, ())
+        assert(cache_key(text, generator_copy, (), copies) == key)
+        with open(os.path.join(sources_dir, 'grammar_analysis.py'),
+                  'a') as outfile:
+            outfile.write('\n')
+        assert(cache_key(text, generator_copy, (), copies) != key)
+
+        # A corrupt entry is regenerated rather than raising.
+        key = cache_key(text, canonical_lr_generator.__file__, ())
+        with open(os.path.join(cache_dir, key + '.pickle'), 'wb') as outfile:
+            outfile.write(b'not a pickle')
+        cached('tutorial-grammar.txt')
+        assert(calls == [(), ('lalr',), (), ()])
+    finally:
+        shutil.rmtree(cache_dir)
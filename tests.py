@@ -1,7 +1,7 @@
 import unittest
 import operator
 import random
-from parsing_from_text import (parse_from_string, general_parse_from_string, ParametrisedTokenizer)
+from parsing_from_text import (parse_from_string, general_parse_from_string, ParametrisedTokenizer, ScanningTokenizer, SpanTokenizer, materialise)
 from parse_grammar import get_rules, get_rules_and_tokens
 import itertools as itt
 import manual_tables
@@ -64,6 +64,8 @@ class TestManualExpressions(unittest.TestCase):
     def test_parser_accepts(self):
         rules, named_tokens, unnamed_tokens = get_rules_and_tokens(self.test_rules)
         generated_tokenizer = ParametrisedTokenizer(named_tokens, unnamed_tokens)
+        scanning_tokenizer = ScanningTokenizer(named_tokens, unnamed_tokens)
+        span_tokenizer = SpanTokenizer(named_tokens, unnamed_tokens)
         all_keys = list(rules.keys())
         for _ in range(1000):
             gen_key = random.choice(all_keys)
@@ -80,6 +82,12 @@ class TestManualExpressions(unittest.TestCase):
             via_text_generated_tokenizer = general_parse_from_string(
                             text_expression, generated_tokenizer)
             self.assertEqual(via_text_generated_tokenizer, directly)
+            via_text_scanning_tokenizer = general_parse_from_string(
+                            text_expression, scanning_tokenizer)
+            self.assertEqual(via_text_scanning_tokenizer, directly)
+            via_spans = general_parse_from_string(
+                            memoryview(text_expression.encode()), span_tokenizer)
+            self.assertEqual(materialise(via_spans), directly)
 
 if __name__ == '__main__':
     import default_log_arg